@@ -0,0 +1,66 @@
+import asyncio
+import os
+import httpx
+import ollama
+from dotenv import load_dotenv
+from pymongo import MongoClient
+from langchain_openai import OpenAIEmbeddings
+from langchain.embeddings import CacheBackedEmbeddings
+from langchain.storage import LocalFileStore
+
+_ = load_dotenv()
+
+# Process-wide clients shared by the student agents, so each worker keeps one
+# Mongo pool and one OpenAI HTTP client however many agent modules import them
+MONGO_MAX_POOL_SIZE = 50  # Headroom for the concurrent graph runs and their cache lookups
+OLLAMA_MAX_CONNECTIONS = 64  # Keep-alive pool for the shared ollama client
+# Chat calls in flight per event loop; matches the server's OLLAMA_NUM_PARALLEL
+# so extra requests wait here instead of queueing inside Ollama
+OLLAMA_CHAT_CONCURRENCY = int(os.getenv("OLLAMA_NUM_PARALLEL", "4"))
+OPENAI_MAX_RETRIES = 5  # The OpenAI client backs off exponentially on 429s, honouring Retry-After
+EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR", "emb_cache")
+
+_openai_embeddings = OpenAIEmbeddings(max_retries=OPENAI_MAX_RETRIES)
+# Document and query embeddings cached on disk under a sha256 of the text, so
+# identical text is only sent to OpenAI once, even across restarts
+embeddings = CacheBackedEmbeddings.from_bytes_store(
+    _openai_embeddings,
+    LocalFileStore(EMBEDDING_CACHE_DIR),
+    namespace=_openai_embeddings.model,
+    query_embedding_cache=True,
+    key_encoder="sha256"
+)
+mongo_client = MongoClient(os.environ["MONGODB_URL"], maxPoolSize=MONGO_MAX_POOL_SIZE)
+collection = mongo_client.agents_db.documents
+
+_ollama_client = None
+_ollama_slots = None
+_ollama_loop = None
+
+def ollama_async() -> ollama.AsyncClient:
+    """
+    Shared ollama.AsyncClient for the running event loop, with a keep-alive
+    pool sized so concurrent chat calls each reuse a warm connection. The
+    httpx pool is bound to the loop it was created on, so a caller that runs
+    a fresh loop per call (asyncio.run) gets a fresh client.
+    """
+    _bind_ollama_loop()
+    return _ollama_client
+
+def ollama_slots() -> asyncio.Semaphore:
+    """Semaphore bounding concurrent chat calls on the running event loop to OLLAMA_CHAT_CONCURRENCY"""
+    _bind_ollama_loop()
+    return _ollama_slots
+
+def _bind_ollama_loop():
+    global _ollama_client, _ollama_slots, _ollama_loop
+    loop = asyncio.get_running_loop()
+    if _ollama_loop is not loop:
+        _ollama_client = ollama.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=OLLAMA_MAX_CONNECTIONS,
+                max_keepalive_connections=OLLAMA_MAX_CONNECTIONS
+            )
+        )
+        _ollama_slots = asyncio.Semaphore(OLLAMA_CHAT_CONCURRENCY)
+        _ollama_loop = loop
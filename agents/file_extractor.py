@@ -1,14 +1,27 @@
 import os
+import re
 import logging
-from datetime import datetime
+from datetime import datetime, timezone
 from typing import List
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI, RateLimitError
 from fastapi import UploadFile
-from pymongo import MongoClient
+from pymongo import AsyncMongoClient, MongoClient, ReplaceOne
+from pymongo.errors import BulkWriteError
 from pptx import Presentation
 import pymupdf as fitz
+import numpy as np
+from bson.binary import Binary, BinaryVectorDtype
 import hashlib
+import bisect
+from functools import cache
+from collections import OrderedDict
 import asyncio
+import threading
+import tempfile
+import tiktoken
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import aiofiles
 from dotenv import load_dotenv
 from agents.semantic_chunker import SemanticChunker
 
@@ -18,28 +31,102 @@ _ = load_dotenv()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# OpenAI setup
-openai_client = OpenAI(api_key=os.environ["OPENAI_API_KEY"])
+# OpenAI setup: clients are built on first use so importing this module needs no API key
+@cache
+def _client() -> OpenAI:
+    return OpenAI(api_key=os.environ["OPENAI_API_KEY"])
+
+@cache
+def _async_client() -> AsyncOpenAI:
+    return AsyncOpenAI(api_key=os.environ["OPENAI_API_KEY"])
+
 MAX_TOKENS = 120_000
+UPLOAD_READ_SIZE = 1 << 20  # Stream uploads to disk 1MB at a time
+PIPELINE_QUEUE_SIZE = 2  # Files buffered between ingestion stages
+PIPELINE_WORKERS = 2  # Files each chunk/embed/store stage works on at once
+PDF_EXTRACT_WORKERS = os.cpu_count() or 1
+PDF_PARALLEL_MIN_PAGES = 50  # Below this, worker startup costs more than it saves
+EMBEDDING_CONCURRENCY = 8  # Max embedding requests in flight at once
+EMBEDDING_MAX_RETRIES = 5
+EMBEDDING_BATCH_MAX_ITEMS = 96
+EMBEDDING_BATCH_MAX_TOKENS = 7000
+QUERY_EMBEDDING_CACHE_SIZE = 10_000
+VECTOR_SEARCH_LIMIT = 1  # Only the top chunk is used
+VECTOR_SEARCH_CANDIDATES_PER_RESULT = 20  # ANN candidates scanned per returned result
+_WS_RE = re.compile(r"\s+")
+_BOUNDARY_RE = re.compile(r"[.\n]")
+
+# Shared by every process_files call, so concurrent uploads together stay within EMBEDDING_CONCURRENCY
+_embed_sem = asyncio.Semaphore(EMBEDDING_CONCURRENCY)
+
+# Mongo clients are shared by every FileProcessor in the process, one pair per URL
+_clients = {}
+_clients_lock = threading.Lock()
+_db_lock = asyncio.Lock()
+
+def _get_clients(mongodb_url: str) -> tuple[MongoClient, AsyncMongoClient]:
+    """Return the (sync, async) pymongo client pair for a URL, connecting and pinging only on first use"""
+    with _clients_lock:
+        if mongodb_url not in _clients:
+            client = MongoClient(mongodb_url)
+            client.admin.command('ping')
+            _clients[mongodb_url] = (client, AsyncMongoClient(mongodb_url))
+            logger.info("FileProcessor connected to MongoDB!")
+        return _clients[mongodb_url]
+
+def _quantize(vector: List[float]) -> tuple[Binary, float]:
+    """
+    Scalar-quantize an embedding to int8 so it is stored as a 1-byte-per-dimension BSON vector.
+    Cosine similarity is scale invariant, so the per-vector scale is kept only to allow dequantizing.
+    """
+    v = np.asarray(vector, dtype=np.float32)
+    scale = float(np.max(np.abs(v))) / 127 or 1.0
+    q = np.round(v / scale).astype(np.int8)
+    return Binary.from_vector(q.tolist(), BinaryVectorDtype.INT8), scale
+
+@cache
+def _pdf_pool() -> ProcessPoolExecutor:
+    """
+    Process pool for large-PDF extraction, started on first use and kept for the
+    life of the process. Workers come from a forkserver, since forking this
+    multithreaded server (Mongo monitors, HTTP pools, torch) can deadlock.
+    """
+    return ProcessPoolExecutor(max_workers=PDF_EXTRACT_WORKERS, mp_context=multiprocessing.get_context("forkserver"))
+
+def _extract_pdf_pages(file_path: str, start: int, stop: int) -> str:
+    """Extract text from pages [start, stop) with a document handle owned by this worker"""
+    with fitz.open(file_path) as doc:
+        return "".join(doc[i].get_text() for i in range(start, stop))
 
 class FileProcessor:
     def __init__(self):
         self.supported_formats = {"pdf"}
-        self.db = None
+        self.db = None  # async pymongo database, used by the async ingestion path
+        self.sync_db = None  # pymongo database, used by the synchronous vector search
         self.embedding_model = "text-embedding-3-small"
         self.embedding_dimensions = 1536
+        self._enc = tiktoken.encoding_for_model(self.embedding_model)
+        # In-process LRU of query embeddings in front of the Mongo embedding_cache
+        # collection, keyed on _query_key and shared by both search paths
+        self._query_embeddings = OrderedDict()
+        self._query_embeddings_lock = threading.Lock()
         self.semantic_chunker = SemanticChunker()    
         
-    def init_db(self, mongodb_url: str = "mongodb://localhost:27017"):
-        """Initialize database connection"""
+    def _attach_db(self, mongodb_url: str):
+        """Point this processor at the shared Mongo clients for a URL"""
         try:
-            client = MongoClient(mongodb_url)
-            self.db = client.agents_db
-            client.admin.command('ping')
-            logger.info("FileProcessor connected to MongoDB!")
+            sync_client, async_client = _get_clients(mongodb_url)
         except Exception as e:
             logger.error(f"MongoDB connection error: {e}")
             raise
+        self.sync_db = sync_client.agents_db
+        self.db = async_client.agents_db
+    
+    async def init_db(self, mongodb_url: str = "mongodb://localhost:27017"):
+        """Initialize database connections once; later calls are no-ops"""
+        async with _db_lock:
+            if self.db is None:
+                await asyncio.to_thread(self._attach_db, mongodb_url)
     
     def chunk_text(self, text: str, chunk_size: int = 1000, overlap: int = 100) -> List[str]:
         """
@@ -55,19 +142,18 @@ class FileProcessor:
         
         chunks = []
         start = 0
+        # Positions of every sentence boundary, found in one pass
+        boundaries = [m.start() for m in _BOUNDARY_RE.finditer(text)]
         
         while start < len(text):
             end = start + chunk_size
             
             # Try to end at a sentence boundary
             if end < len(text):
-                # Look for sentence endings within the last 100 characters
-                last_period = text.rfind('.', end - 100, end)
-                last_newline = text.rfind('\n', end - 100, end)
-                boundary = max(last_period, last_newline)
-                
-                if boundary > start:
-                    end = boundary + 1
+                # Look for the last sentence ending within the last 100 characters
+                idx = bisect.bisect_left(boundaries, end) - 1
+                if idx >= 0 and boundaries[idx] >= end - 100 and boundaries[idx] > start:
+                    end = boundaries[idx] + 1
             
             chunk = text[start:end].strip()
             if chunk:
@@ -89,7 +175,7 @@ class FileProcessor:
             List of embedding vectors
         """
         try:
-            response = openai_client.embeddings.create(
+            response = _client().embeddings.create(
                 model=self.embedding_model,
                 input=texts
             )
@@ -98,19 +184,151 @@ class FileProcessor:
             logger.error(f"Error getting embeddings from OpenAI: {e}")
             raise
     
-    def generate_chunk_id(self, filename: str, chunk_index: int, chunk_text: str) -> str:
-        """Generate unique ID for a chunk"""
-        content = f"{filename}_{chunk_index}_{chunk_text[:100]}"
-        return hashlib.md5(content.encode()).hexdigest()
+    async def _get_embeddings_async(self, texts: List[str]) -> List[List[float]]:
+        """
+        Get embeddings for a list of texts using the async OpenAI client,
+        backing off exponentially when rate limited (HTTP 429)
+        
+        Args:
+            texts: List of text strings to embed
+            
+        Returns:
+            List of embedding vectors
+        """
+        for attempt in range(EMBEDDING_MAX_RETRIES):
+            try:
+                response = await _async_client().embeddings.create(
+                    model=self.embedding_model,
+                    input=texts
+                )
+                return [data.embedding for data in response.data]
+            except RateLimitError as e:
+                if attempt == EMBEDDING_MAX_RETRIES - 1:
+                    logger.error(f"Giving up on embedding batch after {EMBEDDING_MAX_RETRIES} rate-limited attempts: {e}")
+                    raise
+                # Honour the server's Retry-After when it sends one
+                retry_after = e.response.headers.get("retry-after") if e.response is not None else None
+                try:
+                    delay = float(retry_after) if retry_after else 2 ** attempt
+                except ValueError:
+                    delay = 2 ** attempt
+                logger.warning(f"Rate limited by OpenAI, retrying embedding batch in {delay}s")
+                await asyncio.sleep(delay)
+            except Exception as e:
+                logger.error(f"Error getting embeddings from OpenAI: {e}")
+                raise
+    
+    async def _sem_embed(self, texts: List[str]) -> List[List[float]]:
+        """Embed a batch while holding a slot of the shared semaphore"""
+        async with _embed_sem:
+            return await self._get_embeddings_async(texts)
+    
+    def _pack_batches(self, token_lens: List[int]) -> List[List[int]]:
+        """
+        Greedily pack chunk indices into embedding batches of at most
+        EMBEDDING_BATCH_MAX_ITEMS items and EMBEDDING_BATCH_MAX_TOKENS tokens.
+        Chunks are visited longest first so each request holds inputs of similar length.
+        
+        Args:
+            token_lens: Token count of each chunk
+            
+        Returns:
+            List of batches, each a list of indices into the original chunks
+        """
+        order = sorted(range(len(token_lens)), key=lambda i: token_lens[i], reverse=True)
+        batches = []
+        batch = []
+        batch_tokens = 0
+        for i in order:
+            if batch and (len(batch) >= EMBEDDING_BATCH_MAX_ITEMS
+                          or batch_tokens + token_lens[i] > EMBEDDING_BATCH_MAX_TOKENS):
+                batches.append(batch)
+                batch = []
+                batch_tokens = 0
+            batch.append(i)
+            batch_tokens += token_lens[i]
+        if batch:
+            batches.append(batch)
+        return batches
+    
+    def _query_key(self, query: str) -> str:
+        """Cache key for a normalized search query under the current embedding model"""
+        return hashlib.sha256(f"{self.embedding_model}\0{query}".encode()).hexdigest()
+    
+    def _cached_query_embedding(self, key: str):
+        """Return a query embedding from the in-process LRU, or None"""
+        with self._query_embeddings_lock:
+            vector = self._query_embeddings.get(key)
+            if vector is not None:
+                self._query_embeddings.move_to_end(key)
+            return vector
+    
+    def _remember_query_embedding(self, key: str, vector: np.ndarray):
+        with self._query_embeddings_lock:
+            self._query_embeddings[key] = vector
+            self._query_embeddings.move_to_end(key)
+            if len(self._query_embeddings) > QUERY_EMBEDDING_CACHE_SIZE:
+                self._query_embeddings.popitem(last=False)
+    
+    def _embed_query(self, query: str) -> np.ndarray:
+        """Embed a normalized search query: in-process LRU, then the embedding_cache collection, then OpenAI"""
+        key = self._query_key(query)
+        vector = self._cached_query_embedding(key)
+        if vector is None:
+            doc = self.sync_db.embedding_cache.find_one({"_id": key}, {"vec": 1})
+            if doc:
+                vector = np.frombuffer(doc["vec"], dtype=np.float32)
+            else:
+                vector = np.asarray(self.get_embeddings([query])[0], dtype=np.float32)
+                try:
+                    self.sync_db.embedding_cache.replace_one({"_id": key}, {"_id": key, "vec": vector.tobytes()}, upsert=True)
+                except Exception as e:
+                    logger.warning(f"Could not store query embedding: {e}")
+            self._remember_query_embedding(key, vector)
+        return vector
+    
+    async def _embed_queries_async(self, queries: List[str]) -> List[np.ndarray]:
+        """Embed distinct normalized queries through the same caches, with one OpenAI request for all misses"""
+        keys = [self._query_key(query) for query in queries]
+        vectors = {}
+        for key in keys:
+            vector = self._cached_query_embedding(key)
+            if vector is not None:
+                vectors[key] = vector
+        
+        missing = [key for key in keys if key not in vectors]
+        if missing:
+            async for doc in self.db.embedding_cache.find({"_id": {"$in": missing}}, {"vec": 1}):
+                vectors[doc["_id"]] = np.frombuffer(doc["vec"], dtype=np.float32)
+        
+        to_embed = [(key, query) for key, query in zip(keys, queries) if key not in vectors]
+        if to_embed:
+            embedded = await self._get_embeddings_async([query for _, query in to_embed])
+            new = {key: np.asarray(vector, dtype=np.float32) for (key, _), vector in zip(to_embed, embedded)}
+            vectors.update(new)
+            try:
+                await self.db.embedding_cache.bulk_write(
+                    [ReplaceOne({"_id": key}, {"_id": key, "vec": vector.tobytes()}, upsert=True) for key, vector in new.items()],
+                    ordered=False
+                )
+            except Exception as e:
+                logger.warning(f"Could not store query embeddings: {e}")
+        
+        for key in keys:
+            self._remember_query_embedding(key, vectors[key])
+        return [vectors[key] for key in keys]
+    
+    def generate_chunk_id(self, filename: str, chunk_index: int) -> str:
+        """Generate unique ID for a chunk from its (filename, chunk_index) key"""
+        content = f"{filename}_{chunk_index}"
+        return hashlib.blake2b(content.encode(), digest_size=16).hexdigest()
     
     def tokenize_text(self, text: str) -> dict:
-        """Tokenize text using OpenAI's tokenizer (placeholder implementation)"""
-        # This is a simplified tokenization - you might want to use tiktoken for accuracy
-        words = text.split()
-        token_count = len(words) * 1.3  # Rough approximation
+        """Tokenize text with the embedding model's tiktoken encoding"""
+        ids = self._enc.encode(text)
         return {
-            "tokens": words,
-            "token_count": int(token_count)
+            "tokens": ids,
+            "token_count": len(ids)
         }
     
     def extract_notes_pptx(self, filepath):
@@ -141,136 +359,188 @@ class FileProcessor:
             metadata: Additional metadata for the document
             
         Returns:
-            Number of documents inserted
+            Number of documents inserted or replaced
         """
         documents_to_insert = []
+        # All chunks of a file share one creation time
+        now = datetime.now(timezone.utc)
         
         for i, (chunk, embedding) in enumerate(zip(chunks, embeddings)):
+            quantized, scale = _quantize(embedding)
             doc = {
-                "_id": self.generate_chunk_id(filename, i, chunk),
+                "_id": self.generate_chunk_id(filename, i),
                 "filename": filename,
                 "chunk_index": i,
                 "text": chunk,
-                "embedding": embedding,
+                "embedding": quantized,
+                "embedding_scale": scale,
                 "embedding_model": self.embedding_model,
-                "created_at": datetime.utcnow(),
+                "created_at": now,
                 "metadata": metadata or {}
             }
             documents_to_insert.append(doc)
         
+        if not documents_to_insert:
+            # Nothing to store; keep whatever an earlier upload of this file left in place
+            return 0
+        
+        # Upsert by _id so re-processing a file overwrites its chunks instead of failing on duplicates
+        operations = [ReplaceOne({"_id": doc["_id"]}, doc, upsert=True) for doc in documents_to_insert]
         try:
-            # Insert documents into the 'documents' collection
-            result = self.db.semantic_documents.insert_many(documents_to_insert, ordered=False)
-            return len(result.inserted_ids)
-        except Exception as e:
-            logger.error(f"Error inserting embeddings: {e}")
-            # Try inserting one by one to handle duplicates
-            inserted_count = 0
-            for doc in documents_to_insert:
-                try:
-                    await self.db.semantic_documents.insert_one(doc)
-                    inserted_count += 1
-                except Exception:
-                    logger.warning(f"Skipped duplicate chunk {doc['chunk_index']} for {filename}")
-            return inserted_count
+            result = await self.db.semantic_documents.bulk_write(operations, ordered=False)
+        except BulkWriteError as e:
+            details = e.details
+            logger.error(f"Error upserting {len(details['writeErrors'])} embeddings for {filename}: {details['writeErrors'][0]['errmsg']}")
+            return details["nUpserted"] + details["nMatched"]
+        stored = result.upserted_count + result.matched_count
+        
+        # A re-upload can produce fewer chunks than the last run; once the new chunks
+        # are all stored, drop the leftover tail so it stops matching searches
+        stale = await self.db.semantic_documents.delete_many({"filename": filename, "chunk_index": {"$gte": len(documents_to_insert)}})
+        if stale.deleted_count:
+            logger.info(f"Removed {stale.deleted_count} stale chunks for {filename}")
+        return stored
+    
+    async def _extract_stage(self, files: List[UploadFile], out_q: asyncio.Queue) -> None:
+        """Pipeline stage 1: save each upload to disk and extract its text"""
+        # Token budget for this call only, so concurrent uploads do not share or reset it
+        total_tokens = 0
+        for file in files:
+            # Save file temporarily to process, under a unique name in $TMPDIR (default /tmp)
+            with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(file.filename)[1]) as temp_file:
+                temp_path = temp_file.name
+            
+            try:
+                async with aiofiles.open(temp_path, "wb") as temp_file:
+                    while data := await file.read(UPLOAD_READ_SIZE):
+                        await temp_file.write(data)
+                
+                # Extract text
+                extracted_text = await asyncio.to_thread(self.extract_pdf_text, temp_path)
+                extracted_notes = self.extract_notes_pptx(temp_path)
+            finally:
+                # Clean up temp file
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+            
+            if extracted_notes:
+                extracted_text = extracted_notes if extracted_text is None else f"{extracted_text}\n{extracted_notes}"
+                logger.info(f"Content extracted from {file.filename}: {extracted_text}")
+            if extracted_text is None:
+                logger.error(f"Failed to extract text from {file.filename}")
+                continue
+            
+            # Tokenize the extracted text
+            tokenization_info = self.tokenize_text(extracted_text)
+            new_tokens = tokenization_info["token_count"]
+            
+            # Check token limit
+            if total_tokens + new_tokens > MAX_TOKENS:
+                logger.warning(f"Skipping {file.filename} as it would exceed token limit")
+                continue
+            
+            total_tokens += new_tokens
+            await out_q.put({"file": file, "text": extracted_text, "token_count": new_tokens})
+        # One sentinel per downstream worker; each worker forwards exactly one
+        for _ in range(PIPELINE_WORKERS):
+            await out_q.put(None)
+    
+    async def _chunk_stage(self, in_q: asyncio.Queue, out_q: asyncio.Queue) -> None:
+        """Pipeline stage 2: split extracted text into semantic chunks"""
+        while (item := await in_q.get()) is not None:
+            # chunks = self.chunk_text(item["text"], chunk_size=1000, overlap=100)
+            item["chunks"] = await self.semantic_chunker.asplit_text(item.pop("text"))
+            logger.info(f"Created {len(item['chunks'])} chunks for {item['file'].filename}")
+            await out_q.put(item)
+        await out_q.put(None)
+    
+    async def _embed_stage(self, in_q: asyncio.Queue, out_q: asyncio.Queue) -> None:
+        """Pipeline stage 3: embed each file's chunks"""
+        while (item := await in_q.get()) is not None:
+            chunks = item["chunks"]
+            
+            # Get embeddings for all token-packed batches concurrently
+            token_lens = [len(self._enc.encode(chunk)) for chunk in chunks]
+            batches = self._pack_batches(token_lens)
+            tasks = [
+                self._sem_embed([chunks[i] for i in batch])
+                for batch in batches
+            ]
+            logger.info(f"Dispatching {len(tasks)} embedding batches for {item['file'].filename}")
+            results = await asyncio.gather(*tasks)
+            
+            # Map vectors back to the original chunk order
+            all_embeddings = [None] * len(chunks)
+            for batch, vectors in zip(batches, results):
+                for i, vector in zip(batch, vectors):
+                    all_embeddings[i] = vector
+            item["embeddings"] = all_embeddings
+            await out_q.put(item)
+        await out_q.put(None)
+    
+    async def _store_stage(self, in_q: asyncio.Queue, processed_files: List[dict]) -> None:
+        """Pipeline stage 4: store chunk embeddings and collect file documents"""
+        while (item := await in_q.get()) is not None:
+            file = item["file"]
+            chunks = item["chunks"]
+            
+            # Store embeddings in MongoDB
+            metadata = {
+                "content_type": file.content_type,
+                "total_chunks": len(chunks),
+                "original_token_count": item["token_count"]
+            }
+            
+            inserted_count = await self.store_embeddings(
+                file.filename, 
+                chunks, 
+                item["embeddings"], 
+                metadata
+            )
+            
+            logger.info(f"Stored {inserted_count} embedding documents for {file.filename}")
+            
+            # Prepare file document for original collection (if you still need it)
+            file_doc = {
+                "filename": file.filename,
+                "content_type": file.content_type,
+                # Raw text already lives in semantic_documents as chunks
+                "content": {
+                    "token_count": item["token_count"]
+                },
+                "embedding_info": {
+                    "total_chunks": len(chunks),
+                    "embedding_model": self.embedding_model,
+                    "chunks_stored": inserted_count
+                },
+                "processed_at": datetime.now(timezone.utc)
+            }
+            processed_files.append(file_doc)
     
     async def process_files(self, files: List[UploadFile]) -> None:
-        """Process files and update the database with embeddings"""
-        if self.db is None:
-            await self.init_db()
+        """
+        Process files and update the database with embeddings.
+        
+        Files flow through extract -> chunk -> embed -> store stages connected by
+        bounded queues, so one file can be extracted while another is being embedded.
+        The chunk, embed and store stages each run PIPELINE_WORKERS workers so
+        several files are in flight per stage.
+        """
+        await self.init_db(mongodb_url=os.environ.get("MONGODB_URL"))
             
         processed_files = []
-        self.total_tokens = 0
+        chunk_q = asyncio.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+        embed_q = asyncio.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+        store_q = asyncio.Queue(maxsize=PIPELINE_QUEUE_SIZE)
         
         try:
-            for file in files:
-                # Save file temporarily to process
-                temp_path = f"/tmp/{file.filename}"
-                
-                try:
-                    contents = await file.read()
-                    with open(temp_path, "wb") as temp_file:
-                        temp_file.write(contents)
-                    
-                    # Extract text
-                    extracted_text = self.extract_pdf_text(temp_path)
-                    extracted_notes = self.extract_notes_pptx(temp_path)
-                    if extracted_notes:
-                        extracted_text = extracted_notes if extracted_text is None else f"{extracted_text}\n{extracted_notes}"
-                        logger.info(f"Content extracted from {file.filename}: {extracted_text}")
-                    if extracted_text is None:
-                        logger.error(f"Failed to extract text from {file.filename}")
-                        continue
-                    
-                    # Tokenize the extracted text
-                    tokenization_info = self.tokenize_text(extracted_text)
-                    new_tokens = tokenization_info["token_count"]
-                    
-                    # Check token limit
-                    if self.total_tokens + new_tokens > MAX_TOKENS:
-                        logger.warning(f"Skipping {file.filename} as it would exceed token limit")
-                        continue
-                    
-                    self.total_tokens += new_tokens
-                    
-                    # Chunk text for embeddings
-                    # chunks = self.chunk_text(extracted_text, chunk_size=1000, overlap=100)
-                    chunks = self.semantic_chunker.split_text(extracted_text)
-                    logger.info(f"Created {len(chunks)} chunks for {file.filename}")
-                    
-                    # Get embeddings in batches
-                    all_embeddings = []
-                    batch_size = 100  # OpenAI API limit
-                    
-                    for i in range(0, len(chunks), batch_size):
-                        batch_chunks = chunks[i:i + batch_size]
-                        logger.info(f"Processing embedding batch {i//batch_size + 1}/{(len(chunks) + batch_size - 1)//batch_size} for {file.filename}")
-                        
-                        batch_embeddings = self.get_embeddings(batch_chunks)
-                        all_embeddings.extend(batch_embeddings)
-                        
-                        # Small delay to avoid rate limiting
-                        await asyncio.sleep(0.1)
-                    
-                    # Store embeddings in MongoDB
-                    metadata = {
-                        "content_type": file.content_type,
-                        "total_chunks": len(chunks),
-                        "original_token_count": new_tokens
-                    }
-                    
-                    inserted_count = await self.store_embeddings(
-                        file.filename, 
-                        chunks, 
-                        all_embeddings, 
-                        metadata
-                    )
-                    
-                    logger.info(f"Stored {inserted_count} embedding documents for {file.filename}")
-                    
-                    # Prepare file document for original collection (if you still need it)
-                    file_doc = {
-                        "filename": file.filename,
-                        "content_type": file.content_type,
-                        "content": {
-                            "content": extracted_text,
-                            "tokens": tokenization_info["tokens"],
-                            "token_count": tokenization_info["token_count"]
-                        },
-                        "embedding_info": {
-                            "total_chunks": len(chunks),
-                            "embedding_model": self.embedding_model,
-                            "chunks_stored": inserted_count
-                        },
-                        "processed_at": datetime.utcnow()
-                    }
-                    processed_files.append(file_doc)
-                    
-                finally:
-                    # Clean up temp file
-                    if os.path.exists(temp_path):
-                        os.remove(temp_path)
-                        
+            # A TaskGroup cancels the remaining stages if one fails, so none is left blocked on its queue
+            async with asyncio.TaskGroup() as stages:
+                stages.create_task(self._extract_stage(files, chunk_q))
+                for _ in range(PIPELINE_WORKERS):
+                    stages.create_task(self._chunk_stage(chunk_q, embed_q))
+                    stages.create_task(self._embed_stage(embed_q, store_q))
+                    stages.create_task(self._store_stage(store_q, processed_files))
         except Exception as e:
             logger.error(f"Error processing files: {e}")
             raise
@@ -278,21 +548,24 @@ class FileProcessor:
         # Store original file documents if needed
         if processed_files:
             try:
-                self.db.files.insert_many(processed_files)
+                await self.db.files.insert_many(processed_files)
                 logger.info(f"Stored {len(processed_files)} file documents")
             except Exception as e:
                 logger.error(f"Error storing file documents: {e}")
     
     def extract_pdf_text(self, file_path):
-        """Extract text from PDF file"""
+        """Extract text from PDF file, sharding page ranges across worker processes for large documents"""
         try:
-            doc = fitz.open(file_path)
-            text = ""
-            for page_num in range(len(doc)):
-                page = doc.load_page(page_num)
-                text += page.get_text()
-            doc.close()
-            return text
+            with fitz.open(file_path) as doc:
+                page_count = doc.page_count
+                if page_count < PDF_PARALLEL_MIN_PAGES or PDF_EXTRACT_WORKERS == 1:
+                    return "".join(page.get_text() for page in doc)
+            
+            step = -(-page_count // PDF_EXTRACT_WORKERS)  # Ceiling division
+            starts = list(range(0, page_count, step))
+            stops = [min(start + step, page_count) for start in starts]
+            parts = _pdf_pool().map(_extract_pdf_pages, [file_path] * len(starts), starts, stops)
+            return "".join(parts)
         except Exception as e:
             logger.error(f"Error extracting PDF: {e}")
             return None
@@ -308,53 +581,28 @@ class FileProcessor:
         Returns:
             str: The cleaned text.
         """
-        # Replace newlines and tabs with a space
-        text = text.replace("\n", " ").replace("\t", " ")
-
-        # Replace multiple spaces with a single space
-        text = " ".join(text.split())
-
-        # Trim leading and trailing spaces
-        text = text.strip()
+        # Collapse every run of whitespace (including newlines and tabs) into a single space, then trim
+        return _WS_RE.sub(" ", text).strip()
 
-        return text
-
-    def vector_search(self, query: str, filename_filter: str = None) -> List[dict]:
-        """
-        Perform vector search using MongoDB Atlas Vector Search
-        
-        Args:
-            query: Search query text
-            limit: Number of results to return
-            filename_filter: Optional filter by filename
-            
-        Returns:
-            List of matching documents with scores
-        """
-        mongodb_url = os.environ.get("MONGODB_URL")
-        if self.db is None:
-            self.init_db(mongodb_url=mongodb_url)
-        
-        # Get query embedding
-        query_embedding = self.get_embeddings([query])[0]
-        
-        # Build aggregation pipeline
+    def _search_pipeline(self, query_embedding: Binary, filename_filter: str = None) -> List[dict]:
+        """Build the $vectorSearch aggregation pipeline for one quantized query vector"""
         pipeline = [
             {
                 "$vectorSearch": {
                     "index": "vector_index_2",  # Your vector index name
                     "path": "embedding",      # Field containing the vectors
-                    "queryVector": query_embedding,  # Your query vector (list of floats)
-                    "numCandidates": 100,     # Number of candidates to consider
-                    "limit": 10               # Number of results to return
+                    "queryVector": query_embedding,  # Your query vector (int8 BSON vector)
+                    "numCandidates": VECTOR_SEARCH_LIMIT * VECTOR_SEARCH_CANDIDATES_PER_RESULT,
+                    "limit": VECTOR_SEARCH_LIMIT
                 }
             },
             {
+                # Return only what the caller reads; the stored embedding and
+                # metadata never leave the server
                 "$project": {
-                    "filename": 1,        # Include the page content
+                    "_id": 0,
                     "text": 1,            # Include text content
                     "chunk_index": 1,    # Include chunk index
-                    "embedding": 1,           # Include embedding if needed
                     "score": {                # Include similarity score
                         "$meta": "vectorSearchScore"
                     }
@@ -365,22 +613,83 @@ class FileProcessor:
         # Add filter if specified
         if filename_filter:
             pipeline[0]["$vectorSearch"]["filter"] = {"filename": {"$in": filename_filter}}
+        return pipeline
+    
+    def _top_result_text(self, result: List[dict]) -> str:
+        """Return the cleaned text of the top search result"""
+        if result:
+            logger.debug("Found %d matching documents", len(result))
+            logger.debug("Top result: %s", result[0]["chunk_index"])
+            result = result[0].get("text", "No content found in top result.")
+            cleaned_text = self.clean_text(result)
+            return cleaned_text
+        else:
+            return "No matching documents found."
+    
+    def vector_search(self, query: str, filename_filter: str = None) -> List[dict]:
+        """
+        Perform vector search using MongoDB Atlas Vector Search
+        
+        Args:
+            query: Search query text
+            limit: Number of results to return
+            filename_filter: Optional filter by filename
+            
+        Returns:
+            List of matching documents with scores
+        """
+        mongodb_url = os.environ.get("MONGODB_URL")
+        if self.sync_db is None:
+            self._attach_db(mongodb_url)
+        
+        # Get query embedding, quantized the same way as the stored int8 vectors
+        normalized_query = self.clean_text(query).lower()
+        query_embedding, _ = _quantize(self._embed_query(normalized_query))
+        pipeline = self._search_pipeline(query_embedding, filename_filter)
         
         try:
-            result = list(self.db.semantic_documents.aggregate(pipeline))
+            result = list(self.sync_db.semantic_documents.aggregate(pipeline))
             # Step 3: Return the top result's chunk
-            if result:
-                print(f"Found {len(result)} matching documents.")
-                print(f"Top result: {result[0]["chunk_index"]}")
-                result = result[0].get("text", "No content found in top result.")
-                cleaned_text = self.clean_text(result)
-                return cleaned_text
-            else:
-                return "No matching documents found."
+            return self._top_result_text(result)
         except Exception as e:
             logger.error(f"Vector search error: {e}")
             return []
     
+    async def vector_search_batch(self, queries: List[str], filename_filter: str = None) -> List[str]:
+        """
+        Vector search for several queries at once: distinct queries missing
+        from the embedding caches are embedded in a single OpenAI request, then
+        the Atlas searches run concurrently on the async client
+        
+        Args:
+            queries: Search query texts
+            filename_filter: Optional filter by filename
+            
+        Returns:
+            The top result's text for each query, in the order of queries
+        """
+        if self.db is None:
+            await self.init_db(os.environ.get("MONGODB_URL"))
+        
+        normalized = [self.clean_text(query).lower() for query in queries]
+        distinct = list(dict.fromkeys(normalized))
+        if not distinct:
+            return []
+        embeddings = await self._embed_queries_async(distinct)
+        
+        async def search(embedding):
+            query_embedding, _ = _quantize(embedding)
+            pipeline = self._search_pipeline(query_embedding, filename_filter)
+            try:
+                result = await (await self.db.semantic_documents.aggregate(pipeline)).to_list(None)
+                return self._top_result_text(result)
+            except Exception as e:
+                logger.error(f"Vector search error: {e}")
+                return []
+        
+        results = dict(zip(distinct, await asyncio.gather(*(search(embedding) for embedding in embeddings))))
+        return [results[query] for query in normalized]
+    
     async def get_document_stats(self, filename: str = None) -> dict:
         """Get statistics about stored documents"""
         match_filter = {}
@@ -397,7 +706,7 @@ class FileProcessor:
             }}
         ]
         
-        cursor = self.db.semantic_documents.aggregate(pipeline)
+        cursor = await self.db.semantic_documents.aggregate(pipeline)
         stats = await cursor.to_list(length=None)
         
         return {
@@ -1,26 +1,85 @@
+import atexit
 import csv
 import os
+import threading
+import pandas as pd
+
+# Below this size the Python reader is quicker than paying pandas' start-up cost
+CSV_FAST_PARSE_MIN_BYTES = 128 * 1024
+CSV_BUFFER_SIZE = 1 << 16
+CSV_FLUSH_EVERY = 20  # Rows buffered per file before forcing them to disk
 
 class CSVWriter:
 
+    def __init__(self):
+        self._handles = {}  # filepath -> (open file, DictWriter, rows since last flush)
+        self._users = {}  # filepath -> sinks currently using it
+        self._lock = threading.Lock()
+        atexit.register(self.close_all)
+
     def write_to_csv(self, filepath, data, fieldnames):
         """
         Write a single row of data to a CSV file.
 
+        The file is opened once and kept open; rows are buffered and flushed every
+        CSV_FLUSH_EVERY rows, and the file is closed when its last CsvSink exits,
+        on close(filepath), or when the process exits. The columns are fixed by
+        the call that opens the file; later calls must pass the same fieldnames.
+
         Args:
             filepath (str): Path to the CSV file.
             data (dict): A dictionary representing the row to write.
             fieldnames (list): List of column names (keys of the data dict).
         """
-        file_exists = os.path.isfile(filepath)
+        with self._lock:
+            if filepath not in self._handles:
+                file_exists = os.path.isfile(filepath)
+                csv_file = open(filepath, mode='a', newline='', encoding='utf-8', buffering=CSV_BUFFER_SIZE)
+                writer = csv.DictWriter(csv_file, fieldnames=fieldnames, delimiter=';')
 
-        with open(filepath, mode='a', newline='', encoding='utf-8') as csv_file:
-            writer = csv.DictWriter(csv_file, fieldnames=fieldnames, delimiter=';')
+                if not file_exists:
+                    writer.writeheader()
 
-            if not file_exists:
-                writer.writeheader()
+                self._handles[filepath] = (csv_file, writer, 0)
 
+            csv_file, writer, pending = self._handles[filepath]
+            if list(writer.fieldnames) != list(fieldnames):
+                raise ValueError(f"{filepath} is open with columns {writer.fieldnames}, not {fieldnames}")
             writer.writerow(data)
+            pending += 1
+            if pending >= CSV_FLUSH_EVERY:
+                csv_file.flush()
+                pending = 0
+            self._handles[filepath] = (csv_file, writer, pending)
+
+    def close(self, filepath):
+        """Flush and close filepath if it is open; the next write reopens it."""
+        with self._lock:
+            handle = self._handles.pop(filepath, None)
+            if handle is not None:
+                handle[0].close()
+
+    def acquire(self, filepath):
+        """Register a user of filepath, so it stays open until the last one releases it."""
+        with self._lock:
+            self._users[filepath] = self._users.get(filepath, 0) + 1
+
+    def release(self, filepath):
+        """Drop a user of filepath, closing the file when none are left."""
+        with self._lock:
+            remaining = self._users.get(filepath, 1) - 1
+            if remaining > 0:
+                self._users[filepath] = remaining
+                return
+            self._users.pop(filepath, None)
+        self.close(filepath)
+
+    def close_all(self):
+        """Flush and close every CSV file opened by write_to_csv."""
+        with self._lock:
+            for csv_file, _, _ in self._handles.values():
+                csv_file.close()
+            self._handles.clear()
 
     def parse_question_csv(self, filepath):
         """
@@ -32,11 +91,43 @@ class CSVWriter:
         Returns:
             list: A list of dictionaries representing each row in the CSV.
         """
-        data = []
+        if os.path.getsize(filepath) >= CSV_FAST_PARSE_MIN_BYTES:
+            # Parse in pandas' C engine, keeping every value as a string like DictReader does
+            df = pd.read_csv(filepath, sep=';', dtype=str, keep_default_na=False, encoding='utf-8')
+            return df.to_dict('records')
+
         with open(filepath, mode='r', encoding='utf-8') as csv_file:
-            reader = csv.DictReader(csv_file, delimiter=';')
-            for row in reader:
-                data.append(row)
-        return data
+            return list(csv.DictReader(csv_file, delimiter=';'))
     
-csv_writer = CSVWriter()
\ No newline at end of file
+csv_writer = CSVWriter()
+
+class CsvSink:
+    """
+    Rows for one results file over a run, e.g. an evaluation batch.
+
+    Rows go through the writer's kept-open handle for the file, so concurrent
+    sinks for the same path share one DictWriter instead of interleaving
+    their buffers; the file is closed when the last of them exits its with-block.
+    """
+
+    def __init__(self, filepath, fieldnames, writer=csv_writer):
+        self.filepath = filepath
+        self.fieldnames = fieldnames
+        self._writer = writer
+
+    def __enter__(self):
+        self._writer.acquire(self.filepath)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._writer.release(self.filepath)
+        return False
+
+    def write(self, data):
+        """
+        Write a single row of data.
+
+        Args:
+            data (dict): A dictionary representing the row to write.
+        """
+        self._writer.write_to_csv(self.filepath, data, self.fieldnames)
\ No newline at end of file
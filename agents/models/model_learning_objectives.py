@@ -1,8 +1,7 @@
 import ollama
 
 # student consisting of learning objectives from all ITSA notes
-model = ollama.create(model='student', from_='phi3:3.8b', system=
-                    """
+STUDENT_SYSTEM = """
                     You are a sophomore Computer Information Systems undergraduate.
                     You will be attending a quiz based on IT Solution Architecture.
 
@@ -110,4 +109,13 @@ model = ollama.create(model='student', from_='phi3:3.8b', system=
                     Avoid Auto Scaling thrashing.
                     Set the min and max capacity parameter values carefully.
 
-                    """)
\ No newline at end of file
+                    """
+
+def ensure_models():
+    """Register the learning-objectives student with Ollama unless it already exists"""
+    existing = {m.model.removesuffix(':latest') for m in ollama.list().models}
+    if 'student' not in existing:
+        ollama.create(model='student', from_='phi3:3.8b', system=STUDENT_SYSTEM)
+
+if __name__ == "__main__":
+    ensure_models()
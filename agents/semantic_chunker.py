@@ -1,31 +1,145 @@
-import json
+import asyncio
+import functools
+import hashlib
+import heapq
+import itertools
+import math
 import re
-from typing import List, TypedDict
-from langgraph.graph import StateGraph, END
+import sqlite3
+import threading
 import logging
 import os
 from dotenv import load_dotenv
+import httpx
+import nltk
+import numpy as np
 import ollama
+import orjson
+import xxhash
 load_dotenv()
 
-class SemanticChunker:
-    def __init__(self):
-        self.n_ctx = 10000
+logger = logging.getLogger(__name__)
+# Per-idea/per-chunk output is verbose, so it is only emitted when asked for
+if os.getenv("CHUNKER_DEBUG"):
+    logger.setLevel(logging.DEBUG)
 
+_IDEA_RE = re.compile(r"Idea \d+: (.*)")
+_SENTENCE_SPLIT_RE = re.compile(r"(?<=[.!?])\s+|\n+")
+_LINE_SPLIT_RE = re.compile(r"\n+")
+_TOKEN_RE = re.compile(r"\w+")
+_JSON_RE = re.compile(r"```json\s*(?P<fenced>\{.*?\})\s*```|(?P<bare>\{.*\})", re.DOTALL)
 
-    def write_chunking_plan(self, content):
-        '''
-            Prompt to extract content ideas.
+# Ollama tags pinned to 4-bit quants since decoding is memory-bandwidth bound.
+# Planning (and "fused" mode) needs the 4B model; extraction only picks sentence
+# IDs for a given idea, which a smaller model handles at a fraction of the cost
+CHUNK_MODEL = os.getenv("CHUNK_MODEL", "qwen3:4b-q4_K_M")
+CHUNK_EXTRACT_MODEL = os.getenv("CHUNK_EXTRACT_MODEL", "qwen3:1.7b-q4_K_M")
+# Keep the model resident between the plan and extraction calls of an upload;
+# every call also sends the same num_ctx, since a different value forces a reload
+CHUNK_KEEP_ALIVE = os.getenv("CHUNK_KEEP_ALIVE", "30m")
+# Keep-alive pool for the shared Ollama client so concurrent calls get their own connection
+OLLAMA_MAX_CONNECTIONS = 16
+# In-flight chunking calls per event loop; match the server's OLLAMA_NUM_PARALLEL
+# so extra requests wait here instead of queueing inside Ollama
+CHUNK_LLM_CONCURRENCY = int(os.getenv("CHUNK_LLM_CONCURRENCY", "4"))
 
-            Parameters:
-            - content (String): Scraped and cleaned content
+# Qwen3 soft switch that skips the <think> block. Planning and extraction are
+# copy-heavy, so reasoning tokens only add decode time; appended at the very
+# end of the prompt to keep the shared prefix intact.
+NO_THINK = "\n/no_think"
 
-            Returns:
-            - list: List of ideas found in the content
-            '''
-        # gemma-2-9b-it prompt
-        summarize_template = '''
-        <start_of_turn>user
+# "llm" asks the chat model to pick related sentences; "embedding" scores every
+# sentence against each idea with a local sentence-transformer instead; "bm25"
+# ranks sentences by term overlap with each idea; "fused" plans the ideas and
+# picks their sentences in a single LLM call.
+CHUNK_EXTRACTION_MODE = os.getenv("CHUNK_EXTRACTION_MODE", "llm")
+SENTENCE_MODEL = os.getenv("CHUNK_SENTENCE_MODEL", "all-MiniLM-L6-v2")
+SENTENCE_SIMILARITY_THRESHOLD = float(os.getenv("CHUNK_SIMILARITY_THRESHOLD", "0.45"))
+# In "llm" mode, plans with more ideas than this are extracted by embedding
+# instead: one ideas x sentences matmul replaces a queue of extraction calls
+CHUNK_EMBEDDING_MIN_IDEAS = int(os.getenv("CHUNK_EMBEDDING_MIN_IDEAS", "32"))
+# A chunk may repeat up to this fraction of its sentences from earlier chunks;
+# above it, the repeated sentences are dropped so the same slide text is not
+# embedded and indexed over and over
+CHUNK_MAX_SENTENCE_OVERLAP = float(os.getenv("CHUNK_MAX_SENTENCE_OVERLAP", "0.5"))
+# Ideas per grouped extraction call. Each group shares the cached document
+# prefix; groups run concurrently and keep the JSON reply per call small
+EXTRACT_BATCH_SIZE = 8
+# Documents shorter than this (characters or sentences) are returned as a single
+# chunk; planning ideas for a title slide only produces hallucinated ideas
+MIN_CHUNKABLE_CHARS = 500
+MIN_CHUNKABLE_SENTENCES = 4
+# Sentences kept per idea and Okapi BM25 parameters for the "bm25" mode
+BM25_TOP_N = 5
+BM25_K1 = 1.5
+BM25_B = 0.75
+# Ideas at or above this cosine similarity are treated as duplicates
+IDEA_DEDUP_SIMILARITY = 0.9
+
+# JSON schema the extraction model is constrained to via Ollama structured outputs
+IDS_SCHEMA = {
+    "type": "object",
+    "properties": {"ids": {"type": "array", "items": {"type": "integer"}}},
+    "required": ["ids"],
+}
+
+
+def _parse_json(response):
+    # Schema-constrained replies parse directly; a model or server that ignores
+    # `format=` may still wrap the object in a ```json fence or prose. Slicing
+    # from the first "{" to the last "}" recovers that without a regex scan,
+    # which is only the last resort
+    try:
+        return orjson.loads(response)
+    except orjson.JSONDecodeError:
+        pass
+    start, end = response.find("{"), response.rfind("}") + 1
+    if 0 <= start < end:
+        try:
+            return orjson.loads(response[start:end])
+        except orjson.JSONDecodeError:
+            pass
+    match = _JSON_RE.search(response)
+    if not match:
+        raise ValueError("No JSON object found in response")
+    return orjson.loads(match['fenced'] or match['bare'])
+
+
+@functools.cache
+def _punkt_available():
+    try:
+        nltk.data.find("tokenizers/punkt_tab")
+        return True
+    except LookupError:
+        logger.warning("NLTK punkt_tab data not found, splitting sentences with a regex instead")
+        return False
+
+
+def _split_sentences(text):
+    # Slide text is mostly line-oriented, so lines are always boundaries; punkt
+    # then splits sentences within a line without breaking on "e.g." or "3.14"
+    if not _punkt_available():
+        return [s.strip() for s in _SENTENCE_SPLIT_RE.split(text) if s.strip()]
+    sentences = []
+    for line in _LINE_SPLIT_RE.split(text):
+        if line.strip():
+            sentences.extend(s.strip() for s in nltk.sent_tokenize(line) if s.strip())
+    return sentences
+
+
+def _number_sentences(sentences):
+    return "\n".join(f"[{i}] {sentence}" for i, sentence in enumerate(sentences))
+
+
+def _pick_ids(sentences, ids):
+    # Map model-picked sentence IDs back to sentences in document order, dropping invalid IDs
+    picked = sorted({i for i in ids if isinstance(i, int) and 0 <= i < len(sentences)})
+    return [sentences[i] for i in picked]
+
+
+# Idea planning prompt. Ollama applies the model's chat template to messages, so
+# the prompts carry no turn markers of their own
+_PLAN_TEMPLATE = '''
         You are a diligent STEM student reviewing study notes for finals. Extract ALL important information as separate ideas.
 
         Extract from these slides:
@@ -61,122 +175,730 @@ class SemanticChunker:
         Idea 2: Kinematic equations apply only when acceleration is constant
         Idea 3: To solve projectile motion: separate x and y components, use appropriate kinematic equations for each
 
-        <end_of_turn>
-        <start_of_turn>model
         '''
 
-        response = ollama.chat(
-        model='qwen3:4b',
-        messages=[
-            {"role": "user", 
-            "content": summarize_template.format(content=content)
-            }
-        ]
-    )
-        all_ideas = response['message']['content']
-        print(f'Chunking plan created: \n{all_ideas}\n')
-
-        pattern = r"Idea \d+: (.*)"
-        matches = re.findall(pattern, all_ideas)
-        list_of_ideas = [idea.strip() for idea in matches]
-
-        return list_of_ideas
-
-    def extract_chunk(self, idea, text):
-        extract_template = '''
-    <start_of_turn>user
-    You are a thoughtful analyst tasked with reviewing a piece of writing and identifying sentences that directly support, explain, or relate to a specific idea.
-    Your job is to extract exact sentences from the original content that are semantically related to the provided idea. These may reinforce the idea, give examples, expand on it, or express it in different words.
+# Extraction prompts are split into a document head shared by every call for
+# that document and a short per-call tail carrying the ideas. The head is built
+# once per document and stays byte-identical, so the server can reuse its
+# cached prefix and only prefill the tail.
+_EXTRACT_HEAD = '''
+    You are a thoughtful analyst tasked with reviewing a piece of writing and identifying sentences that directly support, explain, or relate to specific ideas.
+    Your job is to pick, for each target idea, the sentences from the original content that are semantically related to it. These may reinforce the idea, give examples, expand on it, or express it in different words.
     Do not leave out any context that helps explain the sentences.
-    Here is the original content:
+    Here is the original content, one sentence per line, each prefixed with its ID in square brackets:
     <original_content>
     {content}
     </original_content>
+'''
+
+_EXTRACT_ONE_TAIL = '''
+    Return the IDs of the matching sentences as a JSON object in this format STRICTLY:
+
+    <format>
+    {"ids": [3, 17, 42]}
+    </format>
+
+    Only use IDs that appear in the original content. If no sentences match, return an empty list.
     And here is the target idea:
     <idea>
     {target_idea}
     </idea>
+    '''
 
-    Return the matching sentences in this JSON format STRICTLY:
+_EXTRACT_GROUP_TAIL = '''
+    Return one list of matching sentence IDs per idea as a JSON object keyed by idea number, in this format STRICTLY:
 
     <format>
-    ```json
-    {{"related": [
-    "...",
-    "...",
+    {"idea_1": [3, 17],
+    "idea_2": [42],
     ...
-    ]
-    }}
-    ```
+    }
     </format>
 
-    Only include exact sentences from the original content. If no sentences match, return an empty list.
-    <end_of_turn>
-    <start_of_turn>model
+    Only use IDs that appear in the original content. If no sentences match an idea, return an empty list for it.
+    And here are the target ideas:
+    <ideas>
+    {target_ideas}
+    </ideas>
     '''
-        response = ollama.chat(
-            model='qwen3:4b',
-            messages=[
-                {
-                    "role": "user",
-                    "content": extract_template.format(content=text, target_idea=idea)
-                }
-            ]
-        )
-        response = response['message']['content']
-        # print(f'Extracted related sentences:\n{response}\n')
-        chunk = ""
+
+
+def _split_template(template, field):
+    # Split a prompt around its placeholder once at import time, so building a
+    # prompt is plain concatenation instead of a str.format pass over the text
+    head, _, tail = template.partition("{" + field + "}")
+    return head, tail
+
+
+_PLAN_PRE, _PLAN_POST = _split_template(_PLAN_TEMPLATE, "content")
+_EXTRACT_HEAD_PRE, _EXTRACT_HEAD_POST = _split_template(_EXTRACT_HEAD, "content")
+_EXTRACT_ONE_PRE, _EXTRACT_ONE_POST = _split_template(_EXTRACT_ONE_TAIL, "target_idea")
+_EXTRACT_GROUP_PRE, _EXTRACT_GROUP_POST = _split_template(_EXTRACT_GROUP_TAIL, "target_ideas")
+
+
+# Single-call alternative to plan + extract, used when extraction_mode is "fused"
+_FUSED_TEMPLATE = '''
+    You are a diligent STEM student reviewing study notes for finals. Extract ALL important information as separate ideas, and for each idea pick the sentences of the notes that support, explain, or relate to it.
+
+    Ideas to extract:
+    - Every formula with variable definitions, when it applies, and units where relevant
+    - Technical terms, theorems and their conditions, principles, constants and their values
+    - Step-by-step methods, decision trees for choosing approaches, computational procedures
+    - Any other important points for exam prep
+    Break down complex ideas into multiple items. Do not limit yourself to just 10 ideas.
+
+    Here are the notes, one sentence per line, each prefixed with its ID in square brackets:
+    <original_content>
+    {content}
+    </original_content>
+
+    Return the ideas and the IDs of their related sentences as a JSON object in this format STRICTLY:
+
+    <format>
+    {"ideas": [
+    {"idea": "Newton's second law: F = ma, where F is force (N), m is mass (kg), a is acceleration (m/s²)", "ids": [3, 4]},
+    {"idea": "Kinematic equations apply only when acceleration is constant", "ids": [7]},
+    ...
+    ]}
+    </format>
+
+    Only use IDs that appear in the notes.
+    '''
+
+_FUSED_PRE, _FUSED_POST = _split_template(_FUSED_TEMPLATE, "content")
+
+FUSED_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "ideas": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "idea": {"type": "string"},
+                    "ids": {"type": "array", "items": {"type": "integer"}},
+                },
+                "required": ["idea", "ids"],
+            },
+        }
+    },
+    "required": ["ideas"],
+}
+
+
+@functools.lru_cache(maxsize=8)
+def _extraction_prefix(text):
+    sentences = _split_sentences(text)
+    return sentences, _EXTRACT_HEAD_PRE + _number_sentences(sentences) + _EXTRACT_HEAD_POST
+
+
+def _assemble_chunks(ideas, results, seen):
+    """
+    Yields "idea. sentences" chunks, dropping sentences already used by earlier
+    chunks once the overlap exceeds CHUNK_MAX_SENTENCE_OVERLAP. A chunk keeps
+    its full sentence list if filtering would leave it empty. `seen` holds the
+    sentence hashes of chunks yielded so far for the document.
+    """
+    for idea, related in zip(ideas, results):
+        if not related:
+            continue
+        hashes = [xxhash.xxh3_64_intdigest(sentence) for sentence in related]
+        repeated = sum(h in seen for h in hashes)
+        if repeated / len(related) > CHUNK_MAX_SENTENCE_OVERLAP:
+            fresh = [sentence for sentence, h in zip(related, hashes) if h not in seen]
+            related = fresh or related
+        seen.update(hashes)
+        chunk = idea + ". " + " ".join(related)
+        logger.debug("Extracted chunk: %s", chunk)
+        yield chunk
+
+
+_sentence_model_instance = None
+_sentence_model_lock = threading.Lock()
+
+
+def _sentence_model():
+    # Imported lazily so torch is only loaded once sentence embeddings are needed.
+    # Locked because it is warmed up in a worker thread while the plan decodes
+    global _sentence_model_instance
+    with _sentence_model_lock:
+        if _sentence_model_instance is None:
+            from sentence_transformers import SentenceTransformer
+            _sentence_model_instance = SentenceTransformer(SENTENCE_MODEL)
+    return _sentence_model_instance
+
+
+def _encode(texts):
+    return _sentence_model().encode(list(texts), batch_size=64, convert_to_numpy=True, normalize_embeddings=True)
+
+
+CHUNK_CACHE_PATH = os.getenv("CHUNK_CACHE_PATH", "chunk_cache.sqlite3")
+# Bump whenever a chunking prompt or its output format changes so stale
+# results are not served; callers include the model tag in every key as well
+CHUNK_PROMPT_VERSION = "6"
+
+
+class ChunkCache:
+    """
+    Exact-match sqlite cache for chunking LLM results, so re-uploading the
+    same document skips the Ollama calls entirely.
+    """
+    def __init__(self, path=CHUNK_CACHE_PATH):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache (key TEXT PRIMARY KEY, value BLOB NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS sentence_embeddings (key TEXT PRIMARY KEY, value BLOB NOT NULL)"
+            )
+            self._conn.commit()
+
+    @staticmethod
+    def key(*parts):
+        h = hashlib.blake2b(digest_size=16)
+        for part in (CHUNK_PROMPT_VERSION,) + parts:
+            h.update(part.encode("utf-8"))
+            h.update(b"\0")
+        return h.hexdigest()
+
+    @staticmethod
+    def text_digest(text):
+        # Hash a document once and use the digest in per-idea keys
+        return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM llm_cache WHERE key = ?", (key,)).fetchone()
+        return orjson.loads(row[0]) if row else None
+
+    def set(self, key, value):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value) VALUES (?, ?)", (key, orjson.dumps(value))
+            )
+            self._conn.commit()
+
+    def set_many(self, items):
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO llm_cache (key, value) VALUES (?, ?)",
+                [(key, orjson.dumps(value)) for key, value in items]
+            )
+            self._conn.commit()
+
+    @staticmethod
+    def embedding_key(model, sentence):
+        # Not versioned with the prompts: an embedding only depends on the model
+        return hashlib.blake2b(f"{model}\0{sentence}".encode("utf-8"), digest_size=16).hexdigest()
+
+    def get_embeddings(self, keys):
+        """Returns {key: float32 vector} for the keys that are cached."""
+        found = {}
+        with self._lock:
+            # Stay under sqlite's bound-parameter limit
+            for batch in itertools.batched(keys, 500):
+                rows = self._conn.execute(
+                    f"SELECT key, value FROM sentence_embeddings WHERE key IN ({','.join('?' * len(batch))})", batch
+                ).fetchall()
+                found.update((key, np.frombuffer(value, dtype=np.float32)) for key, value in rows)
+        return found
+
+    def set_embeddings(self, items):
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO sentence_embeddings (key, value) VALUES (?, ?)",
+                [(key, np.asarray(vector, dtype=np.float32).tobytes()) for key, vector in items]
+            )
+            self._conn.commit()
+
+
+class SemanticChunker:
+    def __init__(self, extraction_mode=CHUNK_EXTRACTION_MODE):
+        self.n_ctx = 10000
+        self.extraction_mode = extraction_mode
+        self.plan_model = CHUNK_MODEL
+        self.extract_model = CHUNK_EXTRACT_MODEL
+        self.cache = ChunkCache()
+        self._client = None
+        self._llm_slots = None
+        self._client_loop = None
+
+    def _bind_loop(self):
+        # httpx connections and asyncio semaphores belong to the event loop that
+        # created them, so both are recreated when the loop changes (split_text
+        # runs each call in a fresh loop)
+        loop = asyncio.get_running_loop()
+        if self._client_loop is not loop:
+            self._client = ollama.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=OLLAMA_MAX_CONNECTIONS,
+                    max_keepalive_connections=OLLAMA_MAX_CONNECTIONS
+                )
+            )
+            self._llm_slots = asyncio.Semaphore(CHUNK_LLM_CONCURRENCY)
+            self._client_loop = loop
+
+    @property
+    def client(self):
+        """Shared pooled ollama.AsyncClient for the running event loop."""
+        self._bind_loop()
+        return self._client
+
+    @property
+    def llm_slots(self):
+        """Semaphore bounding concurrent Ollama calls across all documents."""
+        self._bind_loop()
+        return self._llm_slots
+
+    async def preload(self):
+        """
+        Loads the chunking models into Ollama ahead of the first upload, with
+        the same num_ctx/keep_alive the chunking calls use so they are not reloaded.
+        """
+        await asyncio.gather(*[
+            self.client.generate(
+                model=model,
+                options={"num_ctx": self.n_ctx},
+                keep_alive=CHUNK_KEEP_ALIVE
+            )
+            for model in {self.plan_model, self.extract_model}
+        ])
+
+    async def _chat_json(self, model, prompt, schema):
+        """
+        Streams a schema-constrained chat completion and stops reading as soon
+        as the top-level JSON object closes, so any trailing output the model
+        would add is never decoded.
+
+        Args:
+            model (str): Ollama model tag
+            prompt (str): User prompt
+            schema (dict): JSON schema passed as Ollama's `format=`
+
+        Returns:
+            str: Raw response text
+        """
+        parts = []
+        depth = 0
+        in_string = escaped = done = False
+        async with self.llm_slots:
+            stream = await self.client.chat(
+                model=model,
+                messages=[{"role": "user", "content": prompt}],
+                format=schema,
+                stream=True,
+                options={"num_ctx": self.n_ctx},
+                keep_alive=CHUNK_KEEP_ALIVE
+            )
+            try:
+                async for part in stream:
+                    piece = part['message']['content']
+                    parts.append(piece)
+                    for ch in piece:
+                        if in_string:
+                            if escaped:
+                                escaped = False
+                            elif ch == "\\":
+                                escaped = True
+                            elif ch == '"':
+                                in_string = False
+                        elif ch == '"':
+                            in_string = True
+                        elif ch == "{":
+                            depth += 1
+                        elif ch == "}":
+                            depth -= 1
+                            done = depth == 0
+                            if done:
+                                break
+                    if done:
+                        break
+            finally:
+                # Closing the stream drops the connection, which cancels generation
+                await stream.aclose()
+        return "".join(parts)
+
+    async def write_chunking_plan(self, content):
+        '''
+            Prompt to extract content ideas.
+
+            Parameters:
+            - content (String): Scraped and cleaned content
+
+            Returns:
+            - list: List of ideas found in the content
+            '''
+        cache_key = ChunkCache.key("plan", self.plan_model, ChunkCache.text_digest(content))
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            logger.debug("Chunking plan cache hit: %d ideas", len(cached))
+            return cached
+
+
+        # Parse ideas line by line while the rest of the plan is still decoding
+        list_of_ideas = []
+        pending = ""
+        async with self.llm_slots:
+            stream = await self.client.chat(
+                model=self.plan_model,
+                messages=[
+                    {"role": "user",
+                    "content": _PLAN_PRE + content + _PLAN_POST + NO_THINK
+                    }
+                ],
+                stream=True,
+                options={"num_ctx": self.n_ctx},
+                keep_alive=CHUNK_KEEP_ALIVE
+            )
+            async for part in stream:
+                pending += part['message']['content']
+                *lines, pending = pending.split("\n")
+                for line in lines:
+                    match = _IDEA_RE.search(line)
+                    if match:
+                        list_of_ideas.append(match.group(1).strip())
+                        logger.debug("Planned idea %d: %s", len(list_of_ideas), list_of_ideas[-1])
+        match = _IDEA_RE.search(pending)
+        if match:
+            list_of_ideas.append(match.group(1).strip())
+        logger.debug("Chunking plan created: %d ideas", len(list_of_ideas))
+
+        if list_of_ideas:
+            self.cache.set(cache_key, list_of_ideas)
+
+        return list_of_ideas
+
+    async def extract_chunk(self, idea, text):
+        """
+        Extracts the related sentences for a single idea. Used when a grouped
+        extraction reply cannot be parsed, so one bad reply does not empty the whole group.
+
+        Returns:
+            list: Related sentences, empty if the reply cannot be parsed either
+        """
+        cache_key = ChunkCache.key("extract", self.extract_model, ChunkCache.text_digest(text), idea)
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+        sentences, prefix = _extraction_prefix(text)
+        response = await self._chat_json(self.extract_model, prefix + _EXTRACT_ONE_PRE + idea + _EXTRACT_ONE_POST + NO_THINK, IDS_SCHEMA)
         try:
-            # Look for JSON content between triple backticks
-            json_match = re.search(r'```json\s*(.*?)\s*```', response, re.DOTALL)
-            if json_match:
-                json_str = json_match.group(1)
-            else:
-                # If not found, try to extract the entire JSON object
-                json_match = re.search(r'(\{.*\})', response, re.DOTALL)
-                if json_match:
-                    json_str = json_match.group(1)
-                else:
-                    print(f"No JSON found in response: {response}")
-                    return ""
-            
-            parsed_feedback = json.loads(json_str)
-            sentences = parsed_feedback['related']
-            chunk = " ".join(sentences)
-            return chunk
+            parsed_feedback = _parse_json(response)
+            related = _pick_ids(sentences, parsed_feedback['ids'])
+            self.cache.set(cache_key, related)
+            return related
         except Exception as e:
-            print(f"Error parsing feedback JSON: {e}")
-            print(f"Response was: {response}")
-            # Create a default feedback structure if parsing fails
-            return ""
+            logger.warning("Error parsing feedback JSON: %s. Response was: %s", e, response)
+            return []
+
+    async def extract_all_chunks(self, ideas, text):
+        """
+        Extracts the related sentences for several ideas with a single LLM call,
+        so the document is prefilled once instead of once per idea. Results are
+        cached per idea, so only ideas without a cached chunk are sent.
+
+        Args:
+            ideas (list): Ideas from the chunking plan
+            text (str): Original content
+
+        Returns:
+            list: One list of related sentences per idea, in the same order
+        """
+        digest = ChunkCache.text_digest(text)
+        cache_keys = [ChunkCache.key("extract", self.extract_model, digest, idea) for idea in ideas]
+        chunks = [self.cache.get(cache_key) for cache_key in cache_keys]
+        missing = [i for i, chunk in enumerate(chunks) if chunk is None]
+        if not missing:
+            return chunks
+        ideas = [ideas[i] for i in missing]
+
+        keys = [f"idea_{i}" for i in range(1, len(ideas) + 1)]
+        schema = {
+            "type": "object",
+            "properties": {key: {"type": "array", "items": {"type": "integer"}} for key in keys},
+            "required": keys,
+        }
+        sentences, prefix = _extraction_prefix(text)
+        target_ideas = "\n".join(f"Idea {i}: {idea}" for i, idea in enumerate(ideas, 1))
+        response = await self._chat_json(self.extract_model, prefix + _EXTRACT_GROUP_PRE + target_ideas + _EXTRACT_GROUP_POST + NO_THINK, schema)
+        try:
+            parsed = _parse_json(response)
+            extracted = [_pick_ids(sentences, parsed.get(key) or []) for key in keys]
+        except Exception as e:
+            logger.warning("Error parsing grouped extraction JSON: %s. Response was: %s", e, response)
+            extracted = None
+
+        if extracted is None:
+            # Retry the group one idea at a time; extract_chunk caches what it parses
+            for i, chunk in zip(missing, await asyncio.gather(*(self.extract_chunk(idea, text) for idea in ideas))):
+                chunks[i] = chunk
+            return chunks
+        for i, chunk in zip(missing, extracted):
+            chunks[i] = chunk
+        self.cache.set_many((cache_keys[i], chunks[i]) for i in missing)
+        return chunks
+
+    async def plan_and_extract(self, text):
+        """
+        Plans the ideas and picks their related sentences in one LLM call, so
+        the document is prefilled once for the whole upload.
+
+        Args:
+            text (str): Original content
+
+        Returns:
+            tuple: (ideas, related sentence lists) of the same length
+        """
+        cache_key = ChunkCache.key("fused", self.plan_model, ChunkCache.text_digest(text))
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            return cached["ideas"], cached["chunks"]
+
+        sentences = _split_sentences(text)
+        response = await self._chat_json(self.plan_model, _FUSED_PRE + _number_sentences(sentences) + _FUSED_POST + NO_THINK, FUSED_SCHEMA)
+        try:
+            parsed = _parse_json(response)
+            ideas, chunks = [], []
+            for item in parsed['ideas']:
+                idea = item.get('idea', '').strip()
+                if idea:
+                    ideas.append(idea)
+                    chunks.append(_pick_ids(sentences, item.get('ids') or []))
+        except Exception as e:
+            logger.warning("Error parsing fused chunking JSON: %s. Response was: %s", e, response)
+            return [], []
+
+        if ideas:
+            self.cache.set(cache_key, {"ideas": ideas, "chunks": chunks})
+        return ideas, chunks
+
+    def merge_redundant_ideas(self, ideas):
+        """
+        Collapses near-duplicate ideas from the chunking plan so each is
+        extracted once. Pairs at or above IDEA_DEDUP_SIMILARITY are joined with
+        union-find and the longest idea of each group is kept.
+
+        Args:
+            ideas (list): Ideas from the chunking plan
+
+        Returns:
+            list: Deduplicated ideas, in order of first appearance
+        """
+        if len(ideas) < 2:
+            return ideas
+
+        embeddings = _encode(ideas)
+        similarity = embeddings @ embeddings.T
+
+        parent = list(range(len(ideas)))
+
+        def find(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        for i, j in zip(*np.nonzero(np.triu(similarity >= IDEA_DEDUP_SIMILARITY, k=1))):
+            root_i, root_j = find(i), find(j)
+            if root_i != root_j:
+                parent[max(root_i, root_j)] = min(root_i, root_j)
+
+        groups = {}
+        for i, idea in enumerate(ideas):
+            groups.setdefault(find(i), []).append(idea)
+        return [max(members, key=len) for members in groups.values()]
+
+    def extract_chunks_by_embedding(self, ideas, text, sentence_emb=None):
+        """
+        Picks the sentences related to each idea by cosine similarity instead of
+        an LLM call. Sentences are embedded once and reused for every idea.
+
+        Args:
+            ideas (list): Ideas from the chunking plan
+            text (str): Original content
+            sentence_emb (np.ndarray, optional): Precomputed sentence embeddings
+
+        Returns:
+            list: One list of related sentences per idea, in the same order
+        """
+        sentences, _ = _extraction_prefix(text)
+        if not sentences or not ideas:
+            return [[] for _ in ideas]
+
+        if sentence_emb is None:
+            sentence_emb = self._encode_sentences(sentences)
+        idea_emb = _encode(ideas)
+        related = (idea_emb @ sentence_emb.T) >= SENTENCE_SIMILARITY_THRESHOLD
+
+        # np.flatnonzero keeps document order so the chunk reads like the original text
+        return [[sentences[i] for i in np.flatnonzero(row)] for row in related]
+
+    def extract_chunks_by_bm25(self, ideas, text):
+        """
+        Picks the sentences related to each idea with BM25 over an in-memory
+        inverted index of the document's sentences. No model is involved.
+
+        Args:
+            ideas (list): Ideas from the chunking plan
+            text (str): Original content
+
+        Returns:
+            list: One list of related sentences per idea, in the same order
+        """
+        sentences, _ = _extraction_prefix(text)
+        if not sentences or not ideas:
+            return [[] for _ in ideas]
+
+        docs = [_TOKEN_RE.findall(sentence.lower()) for sentence in sentences]
+        # term -> {sentence id: term frequency}
+        index = {}
+        for sid, tokens in enumerate(docs):
+            for term in tokens:
+                postings = index.setdefault(term, {})
+                postings[sid] = postings.get(sid, 0) + 1
+        n_docs = len(docs)
+        avgdl = sum(map(len, docs)) / n_docs or 1
+        norms = [BM25_K1 * (1 - BM25_B + BM25_B * len(tokens) / avgdl) for tokens in docs]
+
+        chunks = []
+        for idea in ideas:
+            scores = {}
+            for term in set(_TOKEN_RE.findall(idea.lower())):
+                postings = index.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+                for sid, tf in postings.items():
+                    scores[sid] = scores.get(sid, 0.0) + idf * tf * (BM25_K1 + 1) / (tf + norms[sid])
+            top = heapq.nlargest(BM25_TOP_N, scores, key=scores.get)
+            chunks.append([sentences[i] for i in sorted(top)])
+        return chunks
+
+    def _encode_sentences(self, sentences):
+        """
+        Embeds document sentences through the persistent embedding cache, so
+        boilerplate repeated across a course's decks (headers, footers, shared
+        definitions) is only encoded once.
+
+        Args:
+            sentences (list): Sentences to embed
+
+        Returns:
+            np.ndarray: One normalized embedding per sentence, in the same order
+        """
+        keys = [ChunkCache.embedding_key(SENTENCE_MODEL, sentence) for sentence in sentences]
+        cached = self.cache.get_embeddings(list(set(keys)))
+        missing = list({key: sentence for key, sentence in zip(keys, sentences) if key not in cached}.items())
+        if missing:
+            encoded = _encode([sentence for _, sentence in missing])
+            new = [(key, vector) for (key, _), vector in zip(missing, encoded)]
+            self.cache.set_embeddings(new)
+            cached.update(new)
+        logger.debug("Sentence embeddings: %d cached, %d encoded", len(keys) - len(missing), len(missing))
+        return np.stack([cached[key] for key in keys])
+
+    def _prepare_embeddings(self, text):
+        """
+        CPU/GPU-side work that does not depend on the plan: loads the sentence
+        model for idea dedup and, in embedding mode, encodes the sentences.
+        """
+        if self.extraction_mode == "embedding":
+            sentences, _ = _extraction_prefix(text)
+            return self._encode_sentences(sentences) if sentences else None
+        _sentence_model()
+        return None
 
-    
     def split_text(self, text):
         """
-        Splits text into chunks using RecursiveCharacterTextSplitter.
+        Splits text into semantic chunks; synchronous wrapper around asplit_text.
         
         :param text: The input string to be split.
-        :param chunk_size: Maximum size of each chunk.
-        :param chunk_overlap: Number of overlapping characters between chunks.
         :return: List of text chunks.
         """
-        chunks = []
-        try:
-            list_of_ideas = self.write_chunking_plan(text)
-            print(f'List of ideas: {list_of_ideas}\n')
-            # checked_ideas = self.check_idea_redundancy(list_of_ideas)
-            # print(f'Checked ideas: {checked_ideas}\n')
-            for idea in list_of_ideas:
-                print(f'Extracting chunk for idea: {idea}')
-                chunk = self.extract_chunk(idea, text)
-                if chunk:
-                    print(f'Extracted chunk: {chunk}\n')
-                    chunks.append(idea + ". " + chunk)
-        except Exception as e:
-            print("********************************************** SEMANTIC CHUNKING FAILED **********************************************.")
-            print(e)
+        return asyncio.run(self.asplit_text(text))
+
+    async def asplit_text(self, text):
+        """
+        Splits text into semantic chunks; collects aiter_chunks into a list.
         
-        return chunks
+        :param text: The input string to be split.
+        :return: List of text chunks.
+        """
+        return [chunk async for chunk in self.aiter_chunks(text)]
+
+    async def aiter_chunks(self, text):
+        """
+        Yields semantic chunks as soon as they are ready: one LLM call plans the
+        ideas, then the related sentences are extracted with concurrent LLM calls
+        over groups of EXTRACT_BATCH_SIZE ideas, each group's chunks yielded as
+        its call completes. extraction_mode "embedding" or "bm25" replaces the
+        extraction calls, and large plans in "llm" mode fall back to
+        "embedding"; "fused" does both steps in a single call.
+        
+        :param text: The input string to be split.
+        :return: Async iterator of text chunks.
+        """
+        stripped = text.strip()
+        if len(stripped) < MIN_CHUNKABLE_CHARS or len(_extraction_prefix(text)[0]) < MIN_CHUNKABLE_SENTENCES:
+            if stripped:
+                yield stripped
+            return
+
+        seen = set()
+        pending = []
+        try:
+            if self.extraction_mode == "fused":
+                list_of_ideas, results = await self.plan_and_extract(text)
+                for chunk in _assemble_chunks(list_of_ideas, results, seen):
+                    yield chunk
+                return
+
+            # Run the plan-independent embedding work in a thread while the plan decodes
+            prepared = asyncio.create_task(asyncio.to_thread(self._prepare_embeddings, text))
+            try:
+                list_of_ideas = await self.write_chunking_plan(text)
+            finally:
+                sentence_emb = await prepared
+            logger.debug("List of ideas: %s", list_of_ideas)
+            list_of_ideas = await asyncio.to_thread(self.merge_redundant_ideas, list_of_ideas)
+            logger.debug("Extracting chunks for %d ideas", len(list_of_ideas))
+            if not list_of_ideas:
+                return
+
+            mode = self.extraction_mode
+            if mode == "llm" and len(list_of_ideas) > CHUNK_EMBEDDING_MIN_IDEAS:
+                logger.debug("Plan has %d ideas, extracting by embedding", len(list_of_ideas))
+                mode = "embedding"
+
+            if mode in ("embedding", "bm25"):
+                if mode == "embedding":
+                    results = await asyncio.to_thread(self.extract_chunks_by_embedding, list_of_ideas, text, sentence_emb)
+                else:
+                    results = self.extract_chunks_by_bm25(list_of_ideas, text)
+                for chunk in _assemble_chunks(list_of_ideas, results, seen):
+                    yield chunk
+                return
+
+            async def extract_batch(batch):
+                return batch, await self.extract_all_chunks(batch, text)
+
+            pending = [
+                asyncio.ensure_future(extract_batch(batch))
+                for batch in itertools.batched(list_of_ideas, EXTRACT_BATCH_SIZE)
+            ]
+            for next_done in asyncio.as_completed(pending):
+                batch, results = await next_done
+                for chunk in _assemble_chunks(batch, results, seen):
+                    yield chunk
+        except Exception:
+            logger.exception("Semantic chunking failed")
+        finally:
+            # The consumer may stop early; don't leave extraction calls running
+            for task in pending:
+                task.cancel()
 
 if __name__ == "__main__":
     # Example
@@ -1,30 +1,134 @@
+import asyncio
+import hashlib
 import json
-import re
-import ollama
-from dotenv import load_dotenv
-from pymongo import MongoClient
+import threading
+from datetime import datetime, timezone
+import numpy as np
+import orjson
 from typing import TypedDict, List, Dict
-from pydantic import BaseModel, Field
-from langchain_openai import OpenAIEmbeddings
-from langchain_ollama import ChatOllama
-from langchain.schema import AIMessage
+from dataclasses import dataclass, field
 from langgraph.graph import StateGraph, END
 from agents.file_extractor import file_processor
-from agents.function_tool import csv_writer
+from agents.function_tool import CsvSink
+from agents._clients import embeddings, mongo_client, ollama_async, ollama_slots
 import os
 import logging
 
-_ = load_dotenv()
-
-embeddings = OpenAIEmbeddings()
-mongo_client = MongoClient(os.environ["MONGODB_URL"])
-collection = mongo_client.agents_db.documents
-
-class AgentDB(BaseModel):
-    id: str = Field(alias="_id")
+logger = logging.getLogger(__name__)
+
+# Planner queries within these limits are searched as-is instead of being
+# condensed into key phrases by another chat call
+KEY_PHRASE_MAX_CHARS = 80
+KEY_PHRASE_MAX_WORDS = 9
+# The critique only fills the report's comment column; STUDENT_COLLECT_CRITIQUE=0
+# drops its chat call from every question
+COLLECT_CRITIQUE = os.getenv("STUDENT_COLLECT_CRITIQUE", "1") != "0"
+_ANSWER_NODES = ["answer", "critique"] if COLLECT_CRITIQUE else ["answer"]
+# Graph runs in flight per abegin_answer_batch. Ollama only decodes
+# OLLAMA_NUM_PARALLEL requests at once, so keep just enough runs going to fill
+# those slots while the others are planning or retrieving
+ANSWER_BATCH_CONCURRENCY = 2 * int(os.getenv("OLLAMA_NUM_PARALLEL", "4"))
+
+# Responses are reused for exact prompt matches, and for calls whose semantic
+# text embeds at least this similar to a cached one in the same scope; set to 1
+# or above to disable the semantic lookup (and the embedding call it costs on every miss)
+LLM_CACHE_SIMILARITY = float(os.getenv("LLM_CACHE_SIMILARITY", "0.97"))
+# Most recent entries kept in memory per (model, schema, scope) for the semantic lookup
+LLM_CACHE_SEMANTIC_MAX_ENTRIES = int(os.getenv("LLM_CACHE_SEMANTIC_MAX_ENTRIES", "5000"))
+llm_cache = mongo_client.agents_db.llm_cache
+# (model, output schema, scope) -> (cached responses, matrix of their normalized
+# semantic text embeddings), loaded from llm_cache on first use and appended to on every store
+_semantic_index = {}
+_semantic_lock = threading.Lock()
+
+def _semantic_entries(index_key):
+    model, schema_key, scope = index_key
+    with _semantic_lock:
+        if index_key not in _semantic_index:
+            docs = list(llm_cache.find(
+                {"model": model, "format": schema_key, "scope": scope, "embedding": {"$exists": True}},
+                {"embedding": 1, "response": 1}
+            ).sort("created_at", -1).limit(LLM_CACHE_SEMANTIC_MAX_ENTRIES))
+            matrix = np.array([doc["embedding"] for doc in docs], dtype=np.float32).reshape(len(docs), -1)
+            _semantic_index[index_key] = ([doc["response"] for doc in docs], matrix)
+        return _semantic_index[index_key]
+
+def _add_semantic_entry(index_key, embedding, response):
+    with _semantic_lock:
+        if index_key in _semantic_index:
+            responses, matrix = _semantic_index[index_key]
+            if len(responses):
+                responses, matrix = responses + [response], np.vstack([matrix, embedding[None, :]])
+            else:
+                responses, matrix = [response], embedding[None, :]
+            # Drop the oldest entries once the scope is over its cap
+            _semantic_index[index_key] = (responses[-LLM_CACHE_SEMANTIC_MAX_ENTRIES:], matrix[-LLM_CACHE_SEMANTIC_MAX_ENTRIES:])
+
+async def cached_chat(model: str, messages: List[Dict], format: dict = None,
+                      semantic_text: str = None, scope: str = "") -> str:
+    """
+    ollama chat with a response cache in Mongo: exact sha256 match on the
+    model, output schema and prompt first, then, when semantic_text is given,
+    cosine similarity over the embeddings of earlier semantic texts in the same scope.
+
+    Args:
+        model: Ollama model name
+        messages: Chat messages; the first message's content is the cache key
+        format: Optional JSON schema the reply is constrained to
+        semantic_text: The variable part of the prompt to match paraphrases on,
+            or None for exact matches only. The fixed instructions are left out
+            so they do not dominate the embedding
+        scope: Only entries stored under the same scope are semantic matches
+
+    Returns:
+        The assistant message content
+    """
+    prompt = messages[0]['content']
+    schema_key = orjson.dumps(format, option=orjson.OPT_SORT_KEYS).decode() if format else ""
+    key = hashlib.sha256(f"{model}\0{schema_key}\0{prompt}".encode("utf-8")).hexdigest()
+    hit = await asyncio.to_thread(llm_cache.find_one, {"_id": key}, {"response": 1})
+    if hit:
+        return hit["response"]
+
+    embedding = None
+    index_key = (model, schema_key, scope)
+    if semantic_text is not None and LLM_CACHE_SIMILARITY < 1:
+        try:
+            embedding = np.asarray(await embeddings.aembed_query(semantic_text), dtype=np.float32)
+            embedding /= np.linalg.norm(embedding) or 1.0
+            responses, matrix = await asyncio.to_thread(_semantic_entries, index_key)
+            if responses:
+                scores = matrix @ embedding
+                best = int(np.argmax(scores))
+                if scores[best] >= LLM_CACHE_SIMILARITY:
+                    return responses[best]
+        except Exception as e:
+            logger.warning("Semantic cache lookup failed: %s", e)
+            embedding = None
+
+    async with ollama_slots():
+        response = await ollama_async().chat(model=model, messages=messages, format=format)
+    content = response['message']['content']
+    doc = {"_id": key, "model": model, "format": schema_key, "response": content, "created_at": datetime.now(timezone.utc)}
+    if embedding is not None:
+        doc["scope"] = scope
+        doc["embedding"] = embedding.tolist()
+        _add_semantic_entry(index_key, embedding, content)
+    await asyncio.to_thread(llm_cache.replace_one, {"_id": key}, doc, upsert=True)
+    return content
+
+# Plain slotted dataclasses: pydantic validation stays at the API boundary
+@dataclass(slots=True, frozen=True)
+class AgentDB:
+    id: str
     name: str
-    studied: List[str] = []
-    messages: List[Dict] = []
+    studied: List[str] = field(default_factory=list)
+    messages: List[Dict] = field(default_factory=list)
+
+    @classmethod
+    def from_doc(cls, doc: dict) -> "AgentDB":
+        """Build from an agents collection document."""
+        return cls(id=str(doc["_id"]), name=doc["name"], studied=doc.get("studied", []), messages=doc.get("messages", []))
 
 class AgentState(TypedDict):
     """State definition for the agent's workflow."""
@@ -38,13 +142,24 @@ class AgentState(TypedDict):
     confidence_score: float
     comment: str
 
-class Question(BaseModel):
+@dataclass(slots=True, frozen=True)
+class Question:
     qn_id: str
     qn_week: int
     qn_stem: str
     qn_options: str
     correct_option: str
 
+    @classmethod
+    def from_doc(cls, doc: dict) -> "Question":
+        """Build from a questions collection document, ignoring extra fields like _id."""
+        return cls(doc["qn_id"], doc["qn_week"], doc["qn_stem"], doc["qn_options"], doc["correct_option"])
+
+    @classmethod
+    def from_text(cls, text: str) -> "Question":
+        """Build from a free-text chat message, which has no id, week or answer key."""
+        return cls("", 0, text, text, "")
+
 PROMPTS = {
     "PLAN": """
             {question}
@@ -135,181 +250,231 @@ PROMPTS = {
             """,
 }
 
+def _template_parts(template: str, *fields: str) -> List[str]:
+    """Split a str.format template around its fields once, so prompts are built by concatenation."""
+    parts = []
+    rest = template
+    for field_name in fields:
+        head, _, rest = rest.partition("{" + field_name + "}")
+        parts.append(head)
+    parts.append(rest)
+    return [part.replace("{{", "{").replace("}}", "}") for part in parts]
+
+_PLAN_HEAD, _PLAN_TAIL = _template_parts(PROMPTS["PLAN"], "question")
+_RETRIEVE_HEAD, _RETRIEVE_TAIL = _template_parts(PROMPTS["RETRIEVE"], "knowledge_list")
+_ANSWER_HEAD, _ANSWER_MID, _ANSWER_TAIL = _template_parts(PROMPTS["ANSWER"], "question", "content")
+_CRITIQUE_HEAD, _CRITIQUE_MID, _CRITIQUE_TAIL = _template_parts(PROMPTS["CRITIQUE"], "question", "content")
+
+def plan_prompt(question: str) -> str:
+    return f"{_PLAN_HEAD}{question}{_PLAN_TAIL}"
+
+def retrieve_prompt(knowledge_list: str) -> str:
+    return f"{_RETRIEVE_HEAD}{knowledge_list}{_RETRIEVE_TAIL}"
+
+def answer_prompt(question: str, content) -> str:
+    return f"{_ANSWER_HEAD}{question}{_ANSWER_MID}{content}{_ANSWER_TAIL}"
+
+def critique_prompt(question: str, content) -> str:
+    return f"{_CRITIQUE_HEAD}{question}{_CRITIQUE_MID}{content}{_CRITIQUE_TAIL}"
+
+# JSON schemas the replies are constrained to via Ollama structured outputs
+SCHEMAS = {
+    "PLAN": {
+        "type": "object",
+        "properties": {"get_knowledge": {"type": "array", "items": {"type": "string"}}},
+        "required": ["get_knowledge"],
+    },
+    "RETRIEVE": {
+        "type": "object",
+        "properties": {"key_phrases": {"type": "array", "items": {"type": "string"}}},
+        "required": ["key_phrases"],
+    },
+    "ANSWER": {
+        "type": "object",
+        "properties": {
+            "final_answer": {"type": "array", "items": {"type": "string"}, "minItems": 1, "maxItems": 1},
+            "confidence_score": {"type": "number"},
+            "justification": {"type": "string"},
+        },
+        "required": ["final_answer", "confidence_score", "justification"],
+    },
+    "CRITIQUE": {
+        "type": "object",
+        "properties": {"comment": {"type": "string"}},
+        "required": ["comment"],
+    },
+}
+
+def _studied_scope(studied: List[str]) -> str:
+    """Semantic cache scope for a student: the files they studied, in any order"""
+    return "\0".join(sorted(studied))
+
+# The answer and critique calls depend on every word of the question and the
+# retrieved content, where a near-identical embedding can still mean a different
+# option or a "NOT", so they only use exact prompt matches
+
 # Model reads the question and decides if it needs additional knowledge to answer
-def plan_node(state: AgentState):
+async def plan_node(state: AgentState):
     """Plan the next steps based on the question."""
-    response = ollama.chat(
+    action = await cached_chat(
         model='student_agent',
         messages=[
             {"role": "user", 
-            "content": PROMPTS["PLAN"].format(question=state['question'])
+            "content": plan_prompt(state['question'])
             }
-        ]
+        ],
+        format=SCHEMAS["PLAN"],
+        semantic_text=state['question'],
+        scope=_studied_scope(state['studied'])
     )
-    action = response['message']['content']
     try:
-        # Look for JSON content between triple backticks
-        json_match = re.search(r'```json\s*(.*?)\s*```', action, re.DOTALL)
-        if json_match:
-            json_str = json_match.group(1)
-        else:
-            # If not found, try to extract the entire JSON object
-            json_str = re.search(r'(\{.*\})', action, re.DOTALL).group(1)
-                
-        parsed_action = json.loads(json_str)
-        print(f"PLAN: {parsed_action}")
+        parsed_action = orjson.loads(action)
+        logger.debug("PLAN: %s", parsed_action)
         
         # Initialize get_knowledge with empty list by default
         state['get_knowledge'] = parsed_action.get('get_knowledge', [])
-        print(f"get_knowledge: {state['get_knowledge']}")
         return state
     except Exception as e:
-        print(f"Error parsing plan response: {e}")
+        logger.error("Error parsing plan response: %s", e)
         # Ensure get_knowledge exists in state even if parsing fails
         state['get_knowledge'] = []
         return state
 
-def knowledge_retrieval_node(state: AgentState):
+async def knowledge_retrieval_node(state: AgentState):
     """Retrieve knowledge needed to answer the question."""
-    response = ollama.chat(
-        model='student_agent',
-        messages=[
-            {
-                "role": "user",
-                "content": PROMPTS["RETRIEVE"].format(knowledge_list=json.dumps(state.get('get_knowledge', [])))
-            }
-        ]
+    get_knowledge = state.get('get_knowledge', [])
+    # Short planner queries already work as search phrases; only ask the model
+    # to condense them when they are verbose
+    needs_condensing = not all(
+        len(query) <= KEY_PHRASE_MAX_CHARS and query.count(' ') < KEY_PHRASE_MAX_WORDS
+        for query in get_knowledge
     )
 
-    key_phrases = response['message']['content']
-
     try:
-        # Try to extract JSON from AI response
-        json_match = re.search(r'```json\s*(.*?)\s*```', key_phrases, re.DOTALL)
-        if json_match:
-            json_str = json_match.group(1)
+        if needs_condensing:
+            response = await cached_chat(
+                model='student_agent',
+                messages=[
+                    {
+                        "role": "user",
+                        "content": retrieve_prompt(json.dumps(get_knowledge))
+                    }
+                ],
+                format=SCHEMAS["RETRIEVE"],
+                semantic_text=json.dumps(get_knowledge),
+                scope=_studied_scope(state['studied'])
+            )
+            key_phrases = orjson.loads(response)['key_phrases']
         else:
-            json_str = re.search(r'(\{.*\})', key_phrases, re.DOTALL).group(1)
-
-        parsed_response = json.loads(json_str)
-        key_phrases = parsed_response['key_phrases']
+            key_phrases = get_knowledge
         state['key_phrases'] = key_phrases
-        # Run the async tool call
-        content = []
-        for phrase in key_phrases:
-            print(f"Calling RAG on key phrase: {phrase}")
-            print(f"Student only studied for {state['studied']}")
-            rag_content = file_processor.vector_search(phrase, state['studied'])
-            print(f"Retrieved content: {rag_content}")
-            content.append(rag_content)
-        # state['content'] = asyncio.run(call_tools(key_phrases))
+        logger.debug("Calling RAG on key phrases: %s", key_phrases)
+        logger.debug("Student only studied for %s", state['studied'])
+        # One embedding request for all phrases; results stay aligned with key_phrases
+        content = await file_processor.vector_search_batch(key_phrases, state['studied'])
+        if logger.isEnabledFor(logging.DEBUG):
+            for rag_content in content:
+                logger.debug("Retrieved content: %s", rag_content)
         state['content'] = content
         return state
     except Exception as e:
-        print(f"Error in knowledge_retrieval_node: {e}")
+        logger.error("Error in knowledge_retrieval_node: %s", e)
         state['content'] = "Failed to retrieve knowledge."
         return state
 
-def answer_node(state):
-    """Generate an answer to the question based on retrieved content."""
+async def answer_node(state):
+    """
+    Generate an answer to the question based on retrieved content. Runs
+    alongside critique_node, so it returns only the keys it sets.
+    """
     # Using retrieved content to answer the question
-    response = ollama.chat(
+    answer = await cached_chat(
         model='student_agent',
         messages=[{
             "role": "user",
-            "content": PROMPTS["ANSWER"].format(question=state['question'], content=state['content'])
-        }]
+            "content": answer_prompt(state['question'], state['content'])
+        }],
+        format=SCHEMAS["ANSWER"]
     )
-    answer = response['message']['content']
     
     try:
-        # Try to extract JSON from AI response
-        json_match = re.search(r'```json\s*(.*?)\s*```', answer, re.DOTALL)
-        if json_match:
-            json_str = json_match.group(1)
-        else:
-            # Fallback: look for JSON-like structure
-            json_match = re.search(r'(\{.*\})', answer, re.DOTALL)
-            if json_match:
-                json_str = json_match.group(1)
-            else:
-                raise ValueError("No JSON found in response")
-        
-        # Clean the JSON string by removing control characters
-        json_str = re.sub(r'[\x00-\x1F\x7F-\x9F]', '', json_str)
-        
-        # Parse the JSON
-        parsed_answer = json.loads(json_str)
+        parsed_answer = orjson.loads(answer)
         
         # Extract values with defaults
         answer = parsed_answer.get('final_answer', ['Unknown'])
         confidence_score = parsed_answer.get('confidence_score', 0.0)
         justification = parsed_answer.get('justification', 'No justification provided')
         
-        print(f"ANSWER: {answer}, CONFIDENCE: {confidence_score}")
+        logger.debug("ANSWER: %s, CONFIDENCE: %s", answer, confidence_score)
         
-        state['final_answer'] = answer
-        state['confidence_score'] = confidence_score
-        state['justification'] = justification
-        
-        return state
+        return {
+            'final_answer': answer,
+            'confidence_score': confidence_score,
+            'justification': justification,
+        }
         
     except json.JSONDecodeError as e:
-        print(f"JSON decode error in answer_node: {e}")
-        print(f"Raw response: {answer}")
-        print(f"Extracted JSON string: {json_str if 'json_str' in locals() else 'None'}")
-        state['final_answer'] = ["Error: Invalid JSON response"]
-        state['confidence_score'] = 0.0
-        state['justification'] = f"JSON parsing failed: {str(e)}"
-        return state
+        logger.error("JSON decode error in answer_node: %s", e)
+        logger.debug("Raw response: %s", answer)
+        return {
+            'final_answer': ["Error: Invalid JSON response"],
+            'confidence_score': 0.0,
+            'justification': f"JSON parsing failed: {str(e)}",
+        }
         
     except Exception as e:
-        print(f"General error in answer_node: {e}")
-        print(f"Raw response: {answer}")
-        state['final_answer'] = ["Error in answer_node"]
-        state['confidence_score'] = 0.0
-        state['justification'] = f"Processing failed: {str(e)}"
-        return state
+        logger.error("General error in answer_node: %s", e)
+        logger.debug("Raw response: %s", answer)
+        return {
+            'final_answer': ["Error in answer_node"],
+            'confidence_score': 0.0,
+            'justification': f"Processing failed: {str(e)}",
+        }
     
-def critique_node(state: AgentState):
-    """Critique the answer for accuracy and completeness."""
-    response = ollama.chat(
+async def critique_node(state: AgentState):
+    """
+    Comment on how well the question fits the content. It only reads the
+    question and content, so it runs alongside answer_node.
+    """
+    critique = await cached_chat(
         model='student_agent',
         messages=[{
             "role": "user", 
-            "content": PROMPTS["CRITIQUE"].format(question=state['question'], content=state['content'])
-            }]
+            "content": critique_prompt(state['question'], state['content'])
+            }],
+        format=SCHEMAS["CRITIQUE"]
     )
-    critique = response['message']['content']
     try:
-        # Try to extract JSON from AI response
-        json_match = re.search(r'```json\s*(.*?)\s*```', critique, re.DOTALL)
-        if json_match:
-            json_str = json_match.group(1)
-        else:
-            json_str = re.search(r'(\{.*\})', critique, re.DOTALL).group(1)
-        
-        # Clean the JSON string by removing control characters and properly escaping
-        json_str = json_str.encode('utf-8').decode('unicode_escape')
-        json_str = re.sub(r'[\x00-\x1F\x7F-\x9F]', '', json_str)
-        
-        parsed_critique = json.loads(json_str)
+        parsed_critique = orjson.loads(critique)
         critique = parsed_critique['comment']
-        print(f"COMMENT: {critique}")
-        state['comment'] = critique
-        return state
+        logger.debug("COMMENT: %s", critique)
+        return {'comment': critique}
     except Exception as e:
-        print(f"Error in critique_node: {e}")
-        state['comment'] = "Failed to comment."
-        return state
-
-def rag_needed(state: AgentState) -> str:
+        logger.error("Error in critique_node: %s", e)
+        return {'comment': "Failed to comment."}
+
+def needs_rag(question: str, studied: List[str]) -> bool:
+    """
+    Cheap pre-check before the planner call. A student who has studied no
+    files has nothing to retrieve (and an empty filename filter would search
+    every student's documents), so the question goes straight to answering.
+    """
+    return bool(studied) and bool(question.strip())
+
+def route_question(state: AgentState) -> str | List[str]:
+    """Entry router: plan retrieval only when needs_rag says it can help."""
+    if needs_rag(state['question'], state['studied']):
+        return "planner"
+    logger.debug("Skipping planner: nothing to retrieve for this student")
+    return _ANSWER_NODES
+
+def rag_needed(state: AgentState) -> str | List[str]:
     """Check if RAG is needed based on the state."""
     if len(state.get("get_knowledge", [])) > 0:
-        print("RAG needed")
+        logger.debug("RAG needed")
         return "retriever"
-    print("RAG not needed")
-    return "answer"
+    logger.debug("RAG not needed")
+    return _ANSWER_NODES
 
 def generate_graph():
     """Generate the state graph for the agent."""
@@ -317,27 +482,38 @@ def generate_graph():
     builder.add_node("planner", plan_node)
     builder.add_node("retriever", knowledge_retrieval_node)
     builder.add_node("answer", answer_node)
-    builder.add_node("critique", critique_node)
+    if COLLECT_CRITIQUE:
+        builder.add_node("critique", critique_node)
 
-    builder.set_entry_point("planner")
+    builder.set_conditional_entry_point(route_question, ["planner", *_ANSWER_NODES])
     builder.add_conditional_edges(
         "planner", 
         rag_needed,
-        {"answer": "answer", "retriever": "retriever"})
-    builder.add_edge("retriever", "answer")
-    builder.add_edge("answer", "critique")
-    builder.add_edge("critique", END)
+        ["retriever", *_ANSWER_NODES])
+    # answer and critique both only need the question and content, so they
+    # run as parallel branches and join at END
+    for node in _ANSWER_NODES:
+        builder.add_edge("retriever", node)
+        builder.add_edge(node, END)
 
     return builder.compile()
 
-def begin_answer(question: Question, agent_db: AgentDB, csv_name: str):
-    """Start the research process with the given question."""
-    graph = generate_graph()
+# Compiled graphs keep no per-run state, so one instance serves every question
+_GRAPH = generate_graph()
+
+RESULT_FIELDNAMES = ['student_name', 'studied', 'qn_id', 'question', 'final_answer', 'justification', 'confidence_score', 'comment', 'is_correct']
+
+def result_sink(csv_name: str) -> CsvSink:
+    """Sink for answer rows in ./results/<csv_name>; use it as a context manager."""
+    return CsvSink("./results/" + csv_name, RESULT_FIELDNAMES)
+
+async def abegin_answer(question: Question, agent_db: AgentDB, sink: CsvSink):
+    """Start the research process with the given question; the result row goes to sink."""
+    graph = _GRAPH
     thread = {"configurable": {"thread_id": "1"}}
-    final_state = None
     initial_state = {
-        'question': question['qn_options'],
-        'studied': agent_db['studied'],
+        'question': question.qn_options,
+        'studied': agent_db.studied,
         'get_knowledge': [],
         'content': "",
         'final_answer': "",
@@ -346,31 +522,28 @@ def begin_answer(question: Question, agent_db: AgentDB, csv_name: str):
         'comment': ""
     }
     
-    for state in graph.stream(initial_state, thread):
-        print(f"Current state: {state}")
-        final_state = state
-    
-    result = final_state.get('critique')
-    logging.info("LLM answer:" + result['final_answer'][0])
-    logging.info("Correct answer:" + question['correct_option'])
+    result = await graph.ainvoke(initial_state, thread)
+    logger.debug("Final state: %s", result)
+    logger.info("LLM answer: %s", result['final_answer'][0])
+    logger.info("Correct answer: %s", question.correct_option)
 
     is_correct = False
-    if len(final_state['critique']['final_answer']) == 1 and final_state['critique']['final_answer'][0] == question['correct_option']:
+    if len(result['final_answer']) == 1 and result['final_answer'][0] == question.correct_option:
         is_correct = True
 
     csv_data = {
-        'student_name': agent_db['name'],
-        'studied': agent_db['studied'],
-        'qn_id': question['qn_id'],
-        'question': question['qn_options'],
+        'student_name': agent_db.name,
+        'studied': agent_db.studied,
+        'qn_id': question.qn_id,
+        'question': question.qn_options,
         'final_answer': result['final_answer'][0],
         'justification': result['justification'],
         'confidence_score': result['confidence_score'],
         'comment': result['comment'],
         'is_correct': is_correct
     }
-    fieldnames = ['student_name', 'studied', 'qn_id', 'question', 'final_answer', 'justification', 'confidence_score', 'comment', 'is_correct']
-    csv_writer.write_to_csv("./results/" + csv_name, csv_data, fieldnames)
+    # The row may flush the buffered file; keep that disk write off the event loop
+    await asyncio.to_thread(sink.write, csv_data)
 
     return {
         'student_answer': result['final_answer'],
@@ -379,6 +552,27 @@ def begin_answer(question: Question, agent_db: AgentDB, csv_name: str):
         'is_correct': is_correct,
     }
 
+async def abegin_answer_batch(questions: List[Question], agent_db: AgentDB, csv_name: str):
+    """
+    Answer many questions concurrently, one graph run per question, with at
+    most ANSWER_BATCH_CONCURRENCY runs in flight. Ollama batches the
+    concurrent chat calls across its parallel slots; results are returned in
+    the order of questions.
+    """
+    slots = asyncio.Semaphore(ANSWER_BATCH_CONCURRENCY)
+
+    async def answer_one(question):
+        async with slots:
+            return await abegin_answer(question, agent_db, sink)
+
+    with result_sink(csv_name) as sink:
+        return await asyncio.gather(*(answer_one(question) for question in questions))
+
+def begin_answer(question: Question, agent_db: AgentDB, csv_name: str):
+    """Synchronous wrapper around abegin_answer for scripts; not for use inside an event loop."""
+    with result_sink(csv_name) as sink:
+        return asyncio.run(abegin_answer(question, agent_db, sink))
+
 # for testing
 # if __name__ == "__main__":
 #     chat_graph = generate_graph()
@@ -390,7 +584,7 @@ def begin_answer(question: Question, agent_db: AgentDB, csv_name: str):
 #         qn_options="A. To collect data B. To analyze data C. To visualize data D. To store data E. To delete data",
 #         correct_option="B"
 #     ), AgentDB(
-#         _id="123",
+#         id="123",
 #         name="StudentA",
 #         studied=["Week2.pptx"],
 #     )
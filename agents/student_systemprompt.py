@@ -1,21 +1,14 @@
 import json
-import re
 import ollama
-from dotenv import load_dotenv
-from pymongo import MongoClient
+import orjson
 from typing import TypedDict, List, Dict
 from pydantic import BaseModel, Field
-from langchain_openai import OpenAIEmbeddings
 from langgraph.graph import StateGraph, END
 from agents.function_tool import csv_writer
-import os
 import logging
 
-_ = load_dotenv()
+logger = logging.getLogger(__name__)
 
-embeddings = OpenAIEmbeddings()
-mongo_client = MongoClient(os.environ["MONGODB_URL"])
-collection = mongo_client.agents_db.documents
 
 class AgentDB(BaseModel):
     id: str = Field(alias="_id")
@@ -79,6 +72,24 @@ PROMPTS = {
             """,
 }
 
+# JSON schemas the replies are constrained to via Ollama structured outputs
+SCHEMAS = {
+    "ANSWER": {
+        "type": "object",
+        "properties": {
+            "final_answer": {"type": "array", "items": {"type": "string"}, "minItems": 1, "maxItems": 1},
+            "confidence_score": {"type": "number"},
+            "justification": {"type": "string"},
+        },
+        "required": ["final_answer", "confidence_score", "justification"],
+    },
+    "CRITIQUE": {
+        "type": "object",
+        "properties": {"comment": {"type": "string"}},
+        "required": ["comment"],
+    },
+}
+
 def answer_node(state):
     """Generate an answer to the question based on retrieved content."""
     # Using retrieved content to answer the question
@@ -87,35 +98,20 @@ def answer_node(state):
         messages=[{
             "role": "user",
             "content": PROMPTS["ANSWER"].format(question=state['question'])
-        }]
+        }],
+        format=SCHEMAS["ANSWER"]
     )
     answer = response['message']['content']
     
     try:
-        # Try to extract JSON from AI response
-        json_match = re.search(r'```json\s*(.*?)\s*```', answer, re.DOTALL)
-        if json_match:
-            json_str = json_match.group(1)
-        else:
-            # Fallback: look for JSON-like structure
-            json_match = re.search(r'(\{.*\})', answer, re.DOTALL)
-            if json_match:
-                json_str = json_match.group(1)
-            else:
-                raise ValueError("No JSON found in response")
-        
-        # Clean the JSON string by removing control characters
-        json_str = re.sub(r'[\x00-\x1F\x7F-\x9F]', '', json_str)
-        
-        # Parse the JSON
-        parsed_answer = json.loads(json_str)
+        parsed_answer = orjson.loads(answer)
         
         # Extract values with defaults
         answer = parsed_answer.get('final_answer', ['Unknown'])
         confidence_score = parsed_answer.get('confidence_score', 0.0)
         justification = parsed_answer.get('justification', 'No justification provided')
         
-        print(f"ANSWER: {answer}, CONFIDENCE: {confidence_score}")
+        logger.debug("ANSWER: %s, CONFIDENCE: %s", answer, confidence_score)
         
         state['final_answer'] = answer
         state['confidence_score'] = confidence_score
@@ -124,17 +120,16 @@ def answer_node(state):
         return state
         
     except json.JSONDecodeError as e:
-        print(f"JSON decode error in answer_node: {e}")
-        print(f"Raw response: {answer}")
-        print(f"Extracted JSON string: {json_str if 'json_str' in locals() else 'None'}")
+        logger.error("JSON decode error in answer_node: %s", e)
+        logger.debug("Raw response: %s", answer)
         state['final_answer'] = ["Error: Invalid JSON response"]
         state['confidence_score'] = 0.0
         state['justification'] = f"JSON parsing failed: {str(e)}"
         return state
         
     except Exception as e:
-        print(f"General error in answer_node: {e}")
-        print(f"Raw response: {answer}")
+        logger.error("General error in answer_node: %s", e)
+        logger.debug("Raw response: %s", answer)
         state['final_answer'] = ["Error in answer_node"]
         state['confidence_score'] = 0.0
         state['justification'] = f"Processing failed: {str(e)}"
@@ -147,28 +142,18 @@ def critique_node(state: AgentState):
         messages=[{
             "role": "user", 
             "content": PROMPTS["CRITIQUE"].format(question=state['question'])
-            }]
+            }],
+        format=SCHEMAS["CRITIQUE"]
     )
     critique = response['message']['content']
     try:
-        # Try to extract JSON from AI response
-        json_match = re.search(r'```json\s*(.*?)\s*```', critique, re.DOTALL)
-        if json_match:
-            json_str = json_match.group(1)
-        else:
-            json_str = re.search(r'(\{.*\})', critique, re.DOTALL).group(1)
-        
-        # Clean the JSON string by removing control characters and properly escaping
-        json_str = json_str.encode('utf-8').decode('unicode_escape')
-        json_str = re.sub(r'[\x00-\x1F\x7F-\x9F]', '', json_str)
-        
-        parsed_critique = json.loads(json_str)
+        parsed_critique = orjson.loads(critique)
         critique = parsed_critique['comment']
-        print(f"COMMENT: {critique}")
+        logger.debug("COMMENT: %s", critique)
         state['comment'] = critique
         return state
     except Exception as e:
-        print(f"Error in critique_node: {e}")
+        logger.error("Error in critique_node: %s", e)
         state['comment'] = "Failed to comment."
         return state
 
@@ -185,11 +170,13 @@ def generate_graph():
 
     return builder.compile()
 
+# Compiled graphs keep no per-run state, so one instance serves every question
+_GRAPH = generate_graph()
+
 def begin_answer(question: Question, agent_db: AgentDB, csv_name: str):
     """Start the research process with the given question."""
-    graph = generate_graph()
+    graph = _GRAPH
     thread = {"configurable": {"thread_id": "1"}}
-    final_state = None
     initial_state = {
         'question': question['qn_options'],
         'model': "weak_student",
@@ -199,16 +186,13 @@ def begin_answer(question: Question, agent_db: AgentDB, csv_name: str):
         'comment': ""
     }
     
-    for state in graph.stream(initial_state, thread):
-        print(f"Current state: {state}")
-        final_state = state
-    
-    result = final_state.get('critique')
-    logging.info("LLM answer:" + result['final_answer'][0])
-    logging.info("Correct answer:" + question['correct_option'])
+    result = graph.invoke(initial_state, thread)
+    logger.debug("Final state: %s", result)
+    logger.info("LLM answer: %s", result['final_answer'][0])
+    logger.info("Correct answer: %s", question['correct_option'])
 
     is_correct = False
-    if len(final_state['critique']['final_answer']) == 1 and final_state['critique']['final_answer'][0] == question['correct_option']:
+    if len(result['final_answer']) == 1 and result['final_answer'][0] == question['correct_option']:
         is_correct = True
 
     csv_data = {
@@ -1,20 +1,29 @@
-from fastapi import FastAPI, HTTPException, UploadFile, File, Form
-from pydantic import BaseModel, Field
-from typing import List, Dict, Optional
-from motor.motor_asyncio import AsyncIOMotorClient
+from fastapi import FastAPI, HTTPException, UploadFile, File, Form, BackgroundTasks
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
+from pydantic import BaseModel, Field, BeforeValidator
+from typing import Annotated, List, Dict, Optional
+from pymongo import AsyncMongoClient
 from pymongo.server_api import ServerApi
 from bson import ObjectId
-from agents.student_rag import begin_answer
+from agents.student_rag import abegin_answer, result_sink, AgentDB, Question as StudentQuestion
 from agents.student_systemprompt import begin_answer as begin_answer_large
 from agents.file_extractor import file_processor
-from datetime import datetime
+from agents._clients import embeddings
+from agents.models.model_behaviour import ensure_models as ensure_behaviour_models
+from agents.models.model_learning_objectives import ensure_models as ensure_objective_models
+from datetime import datetime, timezone
+from collections import OrderedDict
+import asyncio
+import hashlib
+import inspect
+import orjson
+import time
 import uvicorn
 import os
 import logging
-from langchain_openai import OpenAIEmbeddings
 from langchain_community.vectorstores import MongoDBAtlasVectorSearch
 
-app = FastAPI()
+app = FastAPI(default_response_class=ORJSONResponse)
 db = None
 vector_store = None
 
@@ -25,8 +34,11 @@ class CreateStudent(BaseModel):
     name: str
     studied: List[str] = []
     
+# Accepts a Mongo ObjectId and serializes it as its hex string
+PyObjectId = Annotated[str, BeforeValidator(str)]
+
 class Student(BaseModel):
-    id: str = Field(alias="_id")
+    id: PyObjectId = Field(alias="_id")
     name: str
     studied: List[str] = []
     messages: List[Dict] = []
@@ -45,6 +57,153 @@ class Message(BaseModel):
     message: str
     
 API_URL = "http://localhost:8000" # Default to localhost if not set
+# Questions answered at once across all requests, sized to the OpenAI account tier
+# (35 for tier 1) since each one makes embedding calls
+OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", "35"))
+LLM_SEM = asyncio.Semaphore(OPENAI_MAX_CONCURRENCY)
+ANSWER_CACHE_SIZE = 10_000
+ANSWER_CACHE_TTL = 3600  # Seconds an answer is reused before the student is asked again
+# Cosine similarity at which an earlier /answer message counts as the same question
+SEMANTIC_CACHE_SIMILARITY = float(os.getenv("SEMANTIC_CACHE_SIMILARITY", "0.95"))
+SEMANTIC_CACHE_INDEX = "semantic_cache_index"
+QUESTION_PROJECTION = {"_id": 0, "qn_id": 1, "qn_week": 1, "qn_stem": 1, "qn_options": 1, "correct_option": 1}
+# Answering only needs who the student is and what they studied, not their message history
+AGENT_PROJECTION = {"name": 1, "studied": 1}
+MESSAGE_PROJECTION = {"_id": 0, "query": 1, "response": 1, "timestamp": 1}
+# Agents with their message history: any messages still embedded in the agent
+# document, followed by those in the messages collection, oldest first
+AGENTS_WITH_MESSAGES = [
+    {"$lookup": {
+        "from": "messages",
+        "localField": "_id",
+        "foreignField": "agent_id",
+        "pipeline": [{"$sort": {"timestamp": 1}}, {"$project": MESSAGE_PROJECTION}],
+        "as": "history"
+    }},
+    {"$project": {
+        "name": 1,
+        "studied": {"$ifNull": ["$studied", []]},
+        "messages": {"$concatArrays": [{"$ifNull": ["$messages", []]}, "$history"]}
+    }}
+]
+LISTING_CACHE_TTL = 60  # Seconds a serialized /all_* listing is served from memory
+
+# Process-wide TTL LRU of recent /answer replies, only touched from the event loop
+_answer_cache = OrderedDict()
+
+def _answer_key(agent_id: str, studied: List[str], text: str) -> str:
+    """Key an answer on the student, what they have studied, and the question text"""
+    return hashlib.sha256("\0".join([agent_id, *studied, text]).encode()).hexdigest()
+
+def _cached_answer(key: str):
+    """Return a fresh cached answer, or None"""
+    entry = _answer_cache.get(key)
+    if entry is None:
+        return None
+    expires_at, answer = entry
+    if expires_at < time.monotonic():
+        del _answer_cache[key]
+        return None
+    _answer_cache.move_to_end(key)
+    return answer
+
+def _remember_answer(key: str, answer):
+    _answer_cache[key] = (time.monotonic() + ANSWER_CACHE_TTL, answer)
+    _answer_cache.move_to_end(key)
+    if len(_answer_cache) > ANSWER_CACHE_SIZE:
+        _answer_cache.popitem(last=False)
+
+async def _similar_answer(scope: str, embedding: List[float]):
+    """Return the stored response to the closest earlier message in scope, if it is similar enough"""
+    pipeline = [
+        {"$vectorSearch": {
+            "index": SEMANTIC_CACHE_INDEX,
+            "path": "embedding",
+            "queryVector": embedding,
+            "numCandidates": 20,
+            "limit": 1,
+            "filter": {"scope": scope}
+        }},
+        {"$project": {"_id": 0, "response": 1, "score": {"$meta": "vectorSearchScore"}}}
+    ]
+    hits = await (await db.semantic_cache.aggregate(pipeline)).to_list(1)
+    # Atlas reports cosine similarity rescaled to (1 + cos) / 2
+    if hits and hits[0]["score"] >= (1 + SEMANTIC_CACHE_SIMILARITY) / 2:
+        return hits[0]["response"]
+    return None
+
+def _json_default(obj):
+    """orjson fallback for the BSON types it cannot encode natively"""
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    raise TypeError
+
+async def _json_array(cursor, to_json=lambda doc: doc):
+    """Serialize a cursor as a JSON array one document at a time, so the collection is never held in memory"""
+    yield b"["
+    first = True
+    async for doc in cursor:
+        yield (b"" if first else b",") + orjson.dumps(to_json(doc), default=_json_default)
+        first = False
+    yield b"]"
+
+# Serialized /all_* listings: name -> (expiry, JSON body). The generation is bumped
+# on every write to agents or their messages so a listing streamed during the write is not stored
+_listing_cache = {}
+_listing_generation = 0
+
+def _invalidate_listings():
+    global _listing_generation
+    _listing_generation += 1
+    _listing_cache.clear()
+
+def _cached_json_array(name: str, open_cursor, to_json=lambda doc: doc) -> Response:
+    """
+    Serve a listing from memory while it is fresh, otherwise stream it from a
+    cursor and keep a copy. open_cursor returns a find cursor, or an awaitable
+    one for aggregate, and is only called on a miss.
+    """
+    entry = _listing_cache.get(name)
+    if entry is not None and entry[0] >= time.monotonic():
+        return Response(entry[1], media_type="application/json")
+
+    generation = _listing_generation
+    async def stream():
+        cursor = open_cursor()
+        if inspect.isawaitable(cursor):
+            cursor = await cursor
+        chunks = []
+        async for chunk in _json_array(cursor, to_json):
+            chunks.append(chunk)
+            yield chunk
+        if generation == _listing_generation:
+            _listing_cache[name] = (time.monotonic() + LISTING_CACHE_TTL, b"".join(chunks))
+
+    return StreamingResponse(stream(), media_type="application/json")
+
+async def _listing_body(name: str, open_cursor) -> bytes:
+    """The serialized listing as one body, from memory while it is fresh, otherwise read and cached"""
+    entry = _listing_cache.get(name)
+    if entry is not None and entry[0] >= time.monotonic():
+        return entry[1]
+
+    generation = _listing_generation
+    cursor = open_cursor()
+    if inspect.isawaitable(cursor):
+        cursor = await cursor
+    body = b"".join([chunk async for chunk in _json_array(cursor)])
+    if generation == _listing_generation:
+        _listing_cache[name] = (time.monotonic() + LISTING_CACHE_TTL, body)
+    return body
+
+def _agents_cursor():
+    return db.agents.aggregate(AGENTS_WITH_MESSAGES)
+
+def _questions_cursor():
+    # toggle between questions and questions_manual for LLM questions/manual questions
+    # Mongo sorts by qn_id on its index and sends only the fields the response uses
+    return db.questions_manual.find({}, QUESTION_PROJECTION).sort("qn_id", 1)
+    # return db.questions.find({}, QUESTION_PROJECTION).sort("qn_id", 1)
 
 async def init_db():
     global db, vector_store
@@ -52,11 +211,10 @@ async def init_db():
         # MongoDB Atlas connection string
         mongodb_url = os.getenv("MONGODB_URL")
         # Create a new client and connect to the server with ServerApi=1
-        client = AsyncIOMotorClient(mongodb_url, server_api=ServerApi('1'), serverSelectionTimeoutMS=5000)
+        client = AsyncMongoClient(mongodb_url, server_api=ServerApi('1'), serverSelectionTimeoutMS=5000)
         db = client.agents_db
         
-        # Initialize vector store
-        embeddings = OpenAIEmbeddings()
+        # Initialize vector store, embedding through the shared on-disk cache
         collection_name = "documents"
         index_name = "vector_index"  # This should match your Atlas Search index name
         vector_store = MongoDBAtlasVectorSearch(
@@ -67,6 +225,17 @@ async def init_db():
         
         await client.admin.command('ping')
         print("Successfully connected to MongoDB Atlas!")
+
+        # Index the fields the endpoints look up and sort by, so none of them scan the collection.
+        # create_index is a no-op when the index already exists
+        try:
+            await db.questions_manual.create_index([("qn_id", 1)], unique=True)
+            await db.agents.create_index([("name", 1)])
+            await db.messages.create_index([("agent_id", 1), ("timestamp", -1)])
+            # Paraphrase matches expire with the exact answer cache
+            await db.semantic_cache.create_index([("timestamp", 1)], expireAfterSeconds=ANSWER_CACHE_TTL)
+        except Exception as e:
+            print(f"Warning: Could not create indexes: {e}")
         return True
     except Exception as e:
         print(f"Error connecting to MongoDB Atlas: {e}")
@@ -82,6 +251,19 @@ async def startup_event():
         app.state.is_ready = True
         print("Warning: Application starting without database connection")
 
+    # Register the Ollama student models once per process instead of on every import
+    try:
+        await asyncio.to_thread(ensure_behaviour_models)
+        await asyncio.to_thread(ensure_objective_models)
+    except Exception as e:
+        print(f"Warning: Could not register Ollama student models: {e}")
+
+    # Load the chunking model now so the first upload does not pay for it
+    try:
+        await file_processor.semantic_chunker.preload()
+    except Exception as e:
+        print(f"Warning: Could not preload the chunking model: {e}")
+
 @app.get("/_health")
 async def health_check():
     """Health check endpoint for Cloud Run."""
@@ -121,6 +303,7 @@ async def create_agent(agent_post: CreateStudent):
         try:
             result = await db.agents.insert_one(agent)
             agent_id = str(result.inserted_id)
+            _invalidate_listings()
             print(f"Successfully inserted agent with ID: {agent_id}")  # Debug log
         except Exception as e:
             print(f"MongoDB insertion error: {e}")  # Debug log
@@ -137,8 +320,8 @@ async def get_agent(agent_id: str):
         agent = await db.agents.find_one({"_id": ObjectId(agent_id)})
         if not agent:
             raise HTTPException(status_code=404, detail="Agent not found")
-        # Convert ObjectId to string for JSON serialization
-        agent["_id"] = str(agent["_id"])
+        history = db.messages.find({"agent_id": agent["_id"]}, MESSAGE_PROJECTION).sort("timestamp", 1)
+        agent["messages"] = agent.get("messages", []) + await history.to_list(None)
         return agent
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -146,41 +329,40 @@ async def get_agent(agent_id: str):
 @app.get("/all_agents", response_model=List[Student])
 async def get_all_agents():
     try:
-        agents = []
-        async for agent in db.agents.find():
-            agent["_id"] = str(agent["_id"])  # Convert ObjectId to string
-            agents.append(agent)
-        return agents
+        # The pipeline already shapes each agent like the Student model
+        return _cached_json_array("agents", _agents_cursor)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
     
 @app.get("/all_questions", response_model=List[Question])
 async def get_all_questions():
     try:
-        questions = []
-
-        # toggle between questions and questions_manual for LLM questions/manual questions
-        async for question in db.questions_manual.find():
-        # async for question in db.questions.find():
-
-            questions.append(question)
-        questions.sort(key=lambda x: x["qn_id"])  # Sort questions by qn_id
-        return questions
+        return _cached_json_array("questions", _questions_cursor)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
     
+@app.get("/bootstrap")
+async def bootstrap():
+    """Every agent and question in one response, for clients that load both on start"""
+    try:
+        agents, questions = await asyncio.gather(
+            _listing_body("agents", _agents_cursor),
+            _listing_body("questions", _questions_cursor)
+        )
+        return Response(b'{"agents":' + agents + b',"questions":' + questions + b'}', media_type="application/json")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.get("/all_questions_id", response_model=List[str])
 async def get_all_questions_id():
     try:
-        questions = []
-
         # toggle between questions and questions_manual for LLM questions/manual questions
-        async for question in db.questions_manual.find({}, {"qn_id": 1}):
-        # async for question in db.questions.find({}, {"qn_id": 1}):
-        
-            questions.append(str(question["qn_id"]))
-        questions.sort()  # Sort the question IDs
-        return questions
+        return _cached_json_array(
+            "question_ids",
+            lambda: db.questions_manual.find({}, {"_id": 0, "qn_id": 1}).sort("qn_id", 1),
+            # lambda: db.questions.find({}, {"_id": 0, "qn_id": 1}).sort("qn_id", 1),
+            lambda question: str(question["qn_id"])
+        )
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -188,31 +370,71 @@ async def get_all_questions_id():
 async def delete_agent(agent_id: str):
     try:
         result = await db.agents.delete_one({"_id": ObjectId(agent_id)})
+        await db.messages.delete_many({"agent_id": ObjectId(agent_id)})
+        _invalidate_listings()
         if result.deleted_count == 0:
             raise HTTPException(status_code=404, detail="Agent not found")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+async def _store_message(agent_id: str, query: str, response, timestamp: datetime):
+    """Append an answered message to the student's history"""
+    try:
+        await db.messages.insert_one({
+            "agent_id": ObjectId(agent_id),
+            "query": query,
+            "response": response,
+            "timestamp": timestamp
+        })
+        _invalidate_listings()
+    except Exception as e:
+        logging.error(f"Could not store message for agent {agent_id}: {e}")
+
+async def _store_similar_answer(scope: str, query: str, embedding: List[float], response, timestamp: datetime):
+    """Add an answered message to the semantic cache; the timestamp TTL index expires it"""
+    try:
+        await db.semantic_cache.insert_one({
+            "scope": scope,
+            "query": query,
+            "embedding": embedding,
+            "response": response,
+            "timestamp": timestamp
+        })
+    except Exception as e:
+        logging.error(f"Could not store semantic cache entry: {e}")
+
 @app.post("/answer/{agent_id}", status_code=201)
-async def send_message(agent_id: str, message: Message):
+async def send_message(agent_id: str, message: Message, background_tasks: BackgroundTasks):
     try:
         # Check if agent exists
-        agent = await db.agents.find_one({"_id": ObjectId(agent_id)})
+        agent = await db.agents.find_one({"_id": ObjectId(agent_id)}, AGENT_PROJECTION)
         if not agent:
             raise HTTPException(status_code=404, detail="Agent not found")
 
-        # Run the research process and get the final draft
-        final_draft = begin_answer(question=message.message, agent_db=agent, csv_name="send_query_function.csv")
-
-        # Store the result in MongoDB
-        await db.agents.update_one(
-            {"_id": ObjectId(agent_id)},
-            {"$push": {"messages": {
-                "query": message.message,
-                "response": final_draft,
-                "timestamp": datetime.utcnow()
-            }}}
-        )
+        # Run the research process and get the final draft, unless this student just answered the same
+        # message, or one close enough in meaning to it
+        studied = agent.get("studied", [])
+        cache_key = _answer_key(agent_id, studied, message.message)
+        final_draft = _cached_answer(cache_key)
+        if final_draft is None:
+            scope = _answer_key(agent_id, studied, "")
+            embedding = None
+            try:
+                async with LLM_SEM:
+                    embedding = await embeddings.aembed_query(message.message)
+                final_draft = await _similar_answer(scope, embedding)
+            except Exception as e:
+                logging.warning(f"Semantic cache lookup failed: {e}")
+            if final_draft is None:
+                with result_sink("send_query_function.csv") as sink:
+                    async with LLM_SEM:
+                        final_draft = await abegin_answer(question=StudentQuestion.from_text(message.message), agent_db=AgentDB.from_doc(agent), sink=sink)
+                if embedding is not None:
+                    background_tasks.add_task(_store_similar_answer, scope, message.message, embedding, final_draft, datetime.now(timezone.utc))
+            _remember_answer(cache_key, final_draft)
+
+        # Store the result in MongoDB once the response has been sent
+        background_tasks.add_task(_store_message, agent_id, message.message, final_draft, datetime.now(timezone.utc))
 
         # Return the draft in the expected format
         return {
@@ -236,34 +458,43 @@ async def answer_questions(agent_id: str, request: QuestionRequest):
         if not qn_ids or not isinstance(qn_ids, list):
             raise HTTPException(status_code=400, detail="Invalid questions input")
         
-        agent_db = await db.agents.find_one({"_id": ObjectId(agent_id)})
+        agent_db = await db.agents.find_one({"_id": ObjectId(agent_id)}, AGENT_PROJECTION)
         if not agent_db:
             raise HTTPException(status_code=404, detail="Agent not found")
         
         agent_name = agent_db.get("name", "Unknown Agent")
         csv_name = f"{agent_name}_attempt.csv"
         
-        # Run the research process for each question
-        results = []
+        # Fetch every requested question in one round trip
+        logging.info(f"Fetching questions with IDs: {qn_ids}")
+        # toggle between questions and questions_manual for LLM questions/manual questions
+        cursor = db.questions_manual.find({"qn_id": {"$in": qn_ids}})
+        # cursor = db.questions.find({"qn_id": {"$in": qn_ids}})
+        questions_by_id = {question["qn_id"]: question async for question in cursor}
         for qn_id in qn_ids:
-            # Fetch the question from the database
-            logging.info(f"Fetching question with ID: {qn_id}")
-            
-            # toggle between questions and questions_manual for LLM questions/manual questions
-            question = await db.questions_manual.find_one({"qn_id": qn_id})
-            # question = await db.questions.find_one({"qn_id": qn_id})
-            
-            if not question:
+            if qn_id not in questions_by_id:
                 raise HTTPException(status_code=404, detail=f"Question with ID {qn_id} not found")
-            
-            logging.info(f"Processing question: {question['qn_id']}")
-            final_draft = begin_answer(question=question, agent_db=agent_db, csv_name=csv_name)
-            results.append({
+        
+        # Run the research process for every question concurrently, streaming rows into one results file
+        student = AgentDB.from_doc(agent_db)
+
+        async def answer_one(qn_id):
+            question = questions_by_id[qn_id]
+            # Every question is answered afresh: each run is an evaluation attempt
+            # and must produce its own row in the attempt CSV
+            async with LLM_SEM:
+                logging.info(f"Processing question: {question['qn_id']}")
+                final_draft = await abegin_answer(question=StudentQuestion.from_doc(question), agent_db=student, sink=sink)
+            logging.info(f"Processed question {qn_id}")
+            return {
                 "qn_id": qn_id,
                 "question": question['qn_options'],
                 "response": final_draft
-            })
-            logging.info(f"Processed question {qn_id}")
+            }
+
+        with result_sink(csv_name) as sink:
+            # gather keeps results in qn_ids order
+            results = await asyncio.gather(*(answer_one(qn_id) for qn_id in qn_ids))
         
         return results
     except Exception as e:
@@ -277,7 +508,7 @@ async def update_agent_files(files: List[UploadFile] = File(...)):
         
         # Initialize file processor's database connection
         mongodb_url = os.getenv("MONGODB_URL")
-        file_processor.init_db(mongodb_url)
+        await file_processor.init_db(mongodb_url)
         
         # Process and store files
         logging.info("Starting file processing")
@@ -1,12 +1,16 @@
 import gradio as gr
-import requests
+import httpx
 import json
+import orjson
 from typing import List
 import os
-import concurrent.futures
 
 API_URL = "http://localhost:8000"
 
+# One keep-alive connection pool for every call to the API. No timeout, since
+# answering a batch of questions can take minutes
+CLIENT = httpx.Client(base_url=API_URL, timeout=None, limits=httpx.Limits(max_keepalive_connections=20))
+
 # Define common study subjects
 STUDY_OPTIONS = [
     "Week1.pptx",
@@ -29,24 +33,12 @@ class StudentAgentUI:
 
     def load_data(self):
         try:
-            with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
-                # Submit both API calls concurrently
-                questions_future = executor.submit(requests.get, f"{API_URL}/all_questions")
-                agents_future = executor.submit(requests.get, f"{API_URL}/all_agents")
-                
-                # Get results from both futures
-                questions_response = questions_future.result()
-                agents_response = agents_future.result()
-                
-                # Process questions response
-                if questions_response.status_code == 200:
-                    questions = questions_response.json()
-                    self.question_ids = {question['qn_id']: {'question': question['qn_options'], 'answer': question['correct_option']} for question in questions}
-                
-                # Process agents response
-                if agents_response.status_code == 200:
-                    agents = agents_response.json()
-                    self.agent_ids = {agent['name']: agent['_id'] for agent in agents}
+            # Agents and questions arrive together in one round trip
+            response = CLIENT.get("/bootstrap")
+            if response.status_code == 200:
+                data = orjson.loads(response.content)
+                self.question_ids = {question['qn_id']: {'question': question['qn_options'], 'answer': question['correct_option']} for question in data['questions']}
+                self.agent_ids = {agent['name']: agent['_id'] for agent in data['agents']}
 
         except Exception as e:
             print(f"Error loading data: {str(e)}")
@@ -55,12 +47,12 @@ class StudentAgentUI:
         try:
             # Prepare the agent data
             agent_data = {"name": name, "studied": studied}
-            response = requests.post(
-                f"{API_URL}/create_student",
+            response = CLIENT.post(
+                "/create_student",
                 json=agent_data
             )
             if response.status_code == 201:
-                self.current_agent_id = response.json().get("student_id")
+                self.current_agent_id = orjson.loads(response.content).get("student_id")
                 return f"Agent created successfully! ID: {self.current_agent_id}"
             else:
                 return f"Error creating agent: {response.text}"
@@ -69,9 +61,9 @@ class StudentAgentUI:
 
     def get_agent(self, agent_id: str) -> str:
         try:
-            response = requests.get(f"{API_URL}/agents/{agent_id}")
+            response = CLIENT.get(f"/agents/{agent_id}")
             if response.status_code == 200:
-                return json.dumps(response.json(), indent=2)
+                return json.dumps(orjson.loads(response.content), indent=2)
             else:
                 return f"Error getting agent: {response.text}"
         except Exception as e:
@@ -79,7 +71,7 @@ class StudentAgentUI:
 
     def delete_agent(self, agent_id: str) -> str:
         try:
-            response = requests.delete(f"{API_URL}/agents/{agent_id}")
+            response = CLIENT.delete(f"/agents/{agent_id}")
             if response.status_code == 204:
                 return "Agent deleted successfully!"
             else:
@@ -89,12 +81,12 @@ class StudentAgentUI:
 
     def send_query(self, agent_id: str, query: str) -> str:
         try:
-            response = requests.post(
-                f"{API_URL}/answer/{agent_id}",
+            response = CLIENT.post(
+                f"/answer/{agent_id}",
                 json={"message": query}
             )
             if response.status_code == 201:
-                return response.json().get("response", "No response field in API reply.")
+                return orjson.loads(response.content).get("response", "No response field in API reply.")
             else:
                 return f"Error sending query: {response.text}"
         except Exception as e:
@@ -110,14 +102,14 @@ class StudentAgentUI:
                 return f"Agent '{selected_agent}' not found."
             
             # Send agent_id as path parameter and qn_ids as JSON body
-            response = requests.post(
-                f"{API_URL}/answer_questions/{agent_id}",
+            response = CLIENT.post(
+                f"/answer_questions/{agent_id}",
                 json={"qn_ids": selected_questions},  # Changed from data= to json=
                 headers={"Content-Type": "application/json"}
             )
             
             if response.status_code == 201:
-                return response.json()
+                return orjson.loads(response.content)
             else:
                 return f"Error submitting selections: {response.text}"
         except Exception as e:
@@ -128,8 +120,8 @@ class StudentAgentUI:
             if not files:
                 return "No files selected."
             files_data = [("files", (os.path.basename(f.name), f, "application/octet-stream")) for f in files]
-            response = requests.post(
-                f"{API_URL}/files",
+            response = CLIENT.post(
+                "/files",
                 files=files_data
             )
             if response.status_code == 200:
@@ -141,9 +133,9 @@ class StudentAgentUI:
 
     def get_all_agents(self):
         try:
-            response = requests.get(f"{API_URL}/all_agents")
+            response = CLIENT.get("/all_agents")
             if response.status_code == 200:
-                agents = response.json()
+                agents = orjson.loads(response.content)
                 self.agent_ids = {agent['name']: agent['_id'] for agent in agents}
                 return self.create_agent_cards(agents)
             else:
@@ -178,9 +170,9 @@ class StudentAgentUI:
 
     def get_all_questions(self):
         try:
-            response = requests.get(f"{API_URL}/all_questions")
+            response = CLIENT.get("/all_questions")
             if response.status_code == 200:
-                questions = response.json()
+                questions = orjson.loads(response.content)
                 return self.create_question_cards(questions)
             else:
                 return gr.HTML("<div style='color: red;'>Error fetching questions</div>")
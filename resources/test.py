@@ -1,5 +1,6 @@
 import pandas as pd
 from pymongo import MongoClient
+from pymongo.errors import BulkWriteError
 from dotenv import load_dotenv
 import os
 
@@ -8,51 +9,49 @@ load_dotenv()
 
 def test():
     df = pd.read_csv('manual_options_45MC.csv', sep=',')
-    question_dict = {}
     option_id = {0: 'A', 1: 'B', 2: 'C', 3: 'D', 4: 'E'}
     
-    for row in df.itertuples():
-        if row.qn_id not in question_dict:
-            question_dict[row.qn_id] = {
-                'qn_week': str(row.week),  # Convert week to string
-                'qn_stem': row.stem,  # Renamed for clarity
-                'options': [],
-                'qn_options': row.stem,
-                'correct_option': ""  # This will build the full question with options
-            }
-        
-        if row.is_answer:
-            # If this row is marked as the answer, store the option letter
-            question_dict[row.qn_id]['correct_option'] = option_id[len(question_dict[row.qn_id]['options'])]
-
-        # Get the current option letter based on how many options we already have
-        current_option_letter = option_id[len(question_dict[row.qn_id]['options'])]
-        
-        # Add to the options list
-        question_dict[row.qn_id]['options'].append(
-            current_option_letter
-        )
-        
-        # Build the complete question string with all options so far
-        if len(question_dict[row.qn_id]['options']) == 1:
-            # First option - start with the stem
-            question_dict[row.qn_id]['qn_options'] = row.stem + ' ' + current_option_letter + '. ' + row.option
-        else:
-            # Subsequent options - append to existing
-            question_dict[row.qn_id]['qn_options'] += ' ' + current_option_letter + '. ' + row.option
+    # Letter each option by its position within its question
+    df['letter'] = df.groupby('qn_id').cumcount().map(option_id)
+    df['chunk'] = df['letter'] + '. ' + df['option']
+    
+    # One row per question, in the order questions first appear in the file
+    per_q = df.groupby('qn_id', sort=False).agg(
+        qn_week=('week', 'first'),
+        qn_stem=('stem', 'first'),
+        options=('letter', list),
+        options_str=('chunk', ' '.join)
+    )
+    per_q['qn_week'] = per_q['qn_week'].astype(str)  # Convert week to string
+    # The full question with its options, e.g. "stem A. ... B. ..."
+    per_q['qn_options'] = per_q['qn_stem'] + ' ' + per_q['options_str']
+    # Letter of the option marked as the answer, empty if none is
+    correct = df[df['is_answer'].astype(bool)].groupby('qn_id', sort=False)['letter'].last()
+    per_q['correct_option'] = correct.reindex(per_q.index).fillna('')
+    
+    question_dict = per_q[['qn_week', 'qn_stem', 'options', 'qn_options', 'correct_option']].to_dict('index')
     
     # Connect to MongoDB Atlas
     client = MongoClient(os.getenv('MONGODB_URL'))
     db = client['agents_db']  # Replace with your database name
     collection = db['questions_manual']
+    # qn_id is unique, so rerunning the upload skips questions that are already there
+    collection.create_index('qn_id', unique=True)
     
     # Convert dictionary to list of documents
     documents = [{'qn_id': k, **v} for k, v in question_dict.items()]
     
     # Insert documents into MongoDB
     if documents:
-        collection.insert_many(documents)
-        print(f"Successfully uploaded {len(documents)} questions to MongoDB")
+        # Unordered, so one duplicate does not stop the rest of the batch
+        try:
+            result = collection.insert_many(documents, ordered=False)
+            inserted = len(result.inserted_ids)
+        except BulkWriteError as e:
+            if any(error['code'] != 11000 for error in e.details['writeErrors']):
+                raise
+            inserted = e.details['nInserted']
+        print(f"Successfully uploaded {inserted} new questions to MongoDB ({len(documents) - inserted} already present)")
     
     return question_dict
 